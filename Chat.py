@@ -3,18 +3,20 @@ Streamlit application for the Local RAG System.
 """
 import streamlit as st
 import os
+import sys
 import tempfile
 import uuid
 import time
 import multiprocessing
 import json
+import hashlib
+import base64
+import binascii
 from pathlib import Path
-from src.rag_system import RAGSystem
-from src.document_processor import DocumentProcessor
+from concurrent.futures import ThreadPoolExecutor
 from src.conversation_management import ConversationManager
-from PIL import Image
 import src.config as config
-from src.session_management import SessionManager
+from src.session_management import SessionManager, get_rag_system
 from typing import Dict, Any
 from src.sqlite_manager import SQLiteManager
 from src.utils.logger import AppLogger
@@ -24,17 +26,21 @@ from streamlit_cookies_manager import EncryptedCookieManager
 logger = AppLogger()
 helper_functions = HelperFunctions()
 
+# Block size used when streaming uploaded files to disk
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Number of most recent chat messages rendered on each rerun
+RENDER_WINDOW = 20
+
 VALID_USERNAME = "user"
 VALID_PASSWORD = "password123"
 
 db = SQLiteManager()
 
 # Set environment variable to avoid OpenMP warning (needed for EasyOCR/numpy)
+# PIL and the image processor (torch + EasyOCR) are imported on first image, see get_image_processor()
 os.environ.setdefault('KMP_DUPLICATE_LIB_OK', 'TRUE')
 
-# Import image processor after setting environment variable
-from src.image_processor import ImageProcessor
-
 # Try multimodal component first (supports Ctrl+V paste), fallback to native Streamlit
 try:
     from st_chat_input_multimodal import multimodal_chat_input
@@ -142,24 +148,83 @@ def register():
 def initialize_rag_system():
     """Initialize the RAG system."""
     try:
-        if session_manager.get("rag_system") is None:
-            with st.spinner("Initializing RAG system..."):
-                session_manager.set("rag_system", RAGSystem()) 
-                # Try to load existing vector store
-                session_manager.get("rag_system").load_vectorstore()
-        return session_manager.get("rag_system")
+        rag = get_rag_system()
+        session_manager.set("rag_system", rag)
+        return rag
     except Exception as e:
         st.error(f"Failed to initialize RAG system: {str(e)}")
         st.info("Make sure Ollama is running and DeepSeek R1 8B model is available.")
         return None
 
-def process_uploaded_files(uploaded_files):
+def _save_one(uploaded_file, upload_dir: str):
+    """
+    Write an uploaded file into the upload directory.
+    
+    Returns the saved path and the BLAKE2b hex digest of its content.
+    """
+    # Create temp file in the upload directory
+    # Use a unique filename to avoid conflicts
+    safe_filename = f"temp_{uuid.uuid4().hex[:8]}_{uploaded_file.name}"
+    temp_file_path = os.path.join(upload_dir, safe_filename)
+    
+    # Rewind in case the file was read before (e.g. a retry after a partial failure)
+    uploaded_file.seek(0)
+    
+    # Write file content, hashing it in the same pass so the bytes are only read once
+    file_hash = hashlib.blake2b()
+    buffer = uploaded_file.getbuffer()
+    if not _save_via_tmpfile(upload_dir, temp_file_path, buffer, file_hash):
+        with open(temp_file_path, "wb") as f:
+            _write_blocks(f, buffer, file_hash)
+        
+        # Verify the whole file made it to disk
+        if not os.path.exists(temp_file_path) or os.path.getsize(temp_file_path) != buffer.nbytes:
+            raise Exception(f"Failed to create file: {temp_file_path}")
+    
+    return temp_file_path, file_hash.hexdigest()
+
+def _write_blocks(f, buffer: memoryview, file_hash):
+    """Write a buffer to an open file in blocks, feeding each block to the hash."""
+    for start in range(0, buffer.nbytes, UPLOAD_CHUNK_SIZE):
+        block = buffer[start:start + UPLOAD_CHUNK_SIZE]
+        file_hash.update(block)
+        f.write(block)
+
+def _save_via_tmpfile(upload_dir: str, target_path: str, buffer: memoryview, file_hash) -> bool:
+    """
+    Linux only: write into an anonymous O_TMPFILE and link it into place in one step.
+    
+    Returns False when O_TMPFILE is not available so the caller can fall back to open().
+    """
+    if not sys.platform.startswith("linux") or not hasattr(os, "O_TMPFILE"):
+        return False
+    try:
+        fd = os.open(upload_dir, os.O_TMPFILE | os.O_WRONLY, 0o644)
+    except OSError:
+        # Filesystem doesn't support O_TMPFILE
+        return False
+    
+    with os.fdopen(fd, "wb", buffering=UPLOAD_CHUNK_SIZE) as f:
+        _write_blocks(f, buffer, file_hash)
+        f.flush()
+        if os.fstat(fd).st_size != buffer.nbytes:
+            raise Exception(f"Failed to create file: {target_path}")
+        # linkat either creates the file or raises, so no exists() check is needed.
+        # Passing a dir fd makes os.link use linkat(AT_SYMLINK_FOLLOW), which is
+        # required to link a /proc/self/fd entry.
+        dir_fd = os.open(upload_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.link(f"/proc/self/fd/{fd}", os.path.basename(target_path), dst_dir_fd=dir_fd, follow_symlinks=True)
+        finally:
+            os.close(dir_fd)
+    return True
+
+def process_uploaded_files(rag, uploaded_files):
     """Process uploaded PDF files."""
     if not uploaded_files:
         return False
     
     try:
-        rag = initialize_rag_system()
         if rag is None:
             return False
         
@@ -169,25 +234,30 @@ def process_uploaded_files(uploaded_files):
         
         # Save uploaded files temporarily
         temp_files = []
+        file_hashes = {}
+        skipped = []
         for uploaded_file in uploaded_files:
-            # Create temp file in the upload directory
-            # Use a unique filename to avoid conflicts
-            safe_filename = f"temp_{uuid.uuid4().hex[:8]}_{uploaded_file.name}"
-            temp_file_path = os.path.join(upload_dir, safe_filename)
+            temp_file_path, digest = _save_one(uploaded_file, upload_dir)
             
-            # Write file content
-            with open(temp_file_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
-            
-            # Verify file was created
-            if not os.path.exists(temp_file_path):
-                raise Exception(f"Failed to create file: {temp_file_path}")
+            # Skip files whose chunks are already in the vector store
+            if rag.has_document(digest):
+                os.unlink(temp_file_path)
+                skipped.append(uploaded_file.name)
+                continue
             
             temp_files.append(temp_file_path)
+            file_hashes[temp_file_path] = digest
+        
+        if skipped:
+            st.info(f"Skipped {len(skipped)} already processed document(s): {', '.join(skipped)}")
+        
+        if not temp_files:
+            session_manager.set("documents_processed", True)
+            return True
         
         # Process documents
         with st.spinner(f"Processing {len(temp_files)} document(s)..."):
-            rag.process_documents(temp_files)
+            rag.process_documents(temp_files, file_hashes=file_hashes)
             session_manager.set("documents_processed", True)
         
         # Clean up temp files (optional - you might want to keep them)
@@ -244,105 +314,120 @@ def input_handler(user_input: Dict[str, any]):
     else:
         return None, prompt
     
+@st.cache_resource
+def get_ocr_pool() -> ThreadPoolExecutor:
+    """Process-wide thread pool so OCR runs off the Streamlit script thread."""
+    return ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1), thread_name_prefix="ocr")
+
+@st.cache_resource(show_spinner="Loading OCR engine...")
+def get_image_processor():
+    """OCR engine, imported and built on the first image so chat-only sessions never load torch/EasyOCR."""
+    from src.image_processor import ImageProcessor
+    return ImageProcessor()
+
+def load_image_processor():
+    """Return the shared image processor, or None if no OCR engine is available."""
+    try:
+        return get_image_processor()
+    except Exception as e:
+        logger.error(f"ImageProcessor init failed: {e}")
+        return None
+
+# Seconds between reruns while an OCR job is still running
+OCR_POLL_INTERVAL = 0.25
+
+def run_ocr(image_processor, image):
+    """
+    Run OCR on the shared pool, picking up an in-flight job for the same image after a rerun.
+    
+    `image` is either encoded image bytes (sent to OCR without a PIL decode) or a PIL Image.
+    Returns None while the job is still running; the caller reruns and checks again.
+    """
+    if isinstance(image, bytes):
+        image_key = hashlib.blake2b(image, digest_size=16).hexdigest()
+        ocr_fn = image_processor.process_bytes
+    else:
+        image_key = hashlib.blake2b(image.tobytes(), digest_size=16).hexdigest()
+        ocr_fn = image_processor.process_image
+        
+    job = session_manager.get("ocr_job")
+    if not job or job["key"] != image_key:
+        future = get_ocr_pool().submit(ocr_fn, image)
+        # The image is kept so the turn can resume on a rerun without the chat input
+        job = {"key": image_key, "future": future, "image": image}
+        session_manager.set("ocr_job", job)
+    
+    if not job["future"].done():
+        return None
+    try:
+        return job["future"].result()
+    finally:
+        # Also dropped on failure, so the next attempt resubmits instead of re-raising
+        session_manager.clear("ocr_job")
+    
+# --- Image input normalization ---
+# Each handler turns one kind of chat-input payload into encoded image bytes or a PIL Image.
+
+def _image_from_file(file_obj):
+    """File-like objects (st.file_uploader / native chat input)."""
+    return file_obj.getvalue() if hasattr(file_obj, 'getvalue') else file_obj.read()
+
+def _image_from_str(data: str):
+    """Data URI (data:image/png;base64,...) or bare base64 string."""
+    if data.startswith('data:image/'):
+        try:
+            _, encoded = data.split(',', 1)
+            return base64.b64decode(encoded)
+        except Exception as e:
+            raise ValueError(f"Failed to parse data URI: {str(e)}")
+    # Never treat client-supplied strings as file paths
+    try:
+        return base64.b64decode(data, validate=True)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid image data: {e}")
+
+def _image_from_dict(data: dict):
+    """Payload dicts from multimodal_chat_input; the image sits under one of a few keys."""
+    image_data = None
+    if data.get('type') == 'image':
+        image_data = data.get('content') or data.get('data')
+    if not image_data:
+        image_data = next((data[key] for key in ('data', 'content', 'bytes', 'file', 'image') if key in data), None)
+    if not image_data:
+        raise ValueError(f"Could not find image data in dictionary. Keys: {list(data.keys())}")
+    return normalize_image_input(image_data)
+
+_IMAGE_HANDLERS = {
+    bytes: lambda data: data,
+    str: _image_from_str,
+    dict: _image_from_dict,
+}
+
+def normalize_image_input(uploaded_image):
+    """Convert any supported chat image payload into encoded bytes or a PIL Image."""
+    for input_type, handler in _IMAGE_HANDLERS.items():
+        if isinstance(uploaded_image, input_type):
+            return handler(uploaded_image)
+    if hasattr(uploaded_image, 'read'):
+        return _image_from_file(uploaded_image)
+    # PIL is only imported once an image actually arrives
+    from PIL import Image
+    if isinstance(uploaded_image, Image.Image):
+        return uploaded_image
+    raise ValueError(f"Unsupported image data format: {type(uploaded_image)}")
+
 def process_image(uploaded_image):
-    # Clear any previous image processing state
-    if "pending_inquiry" in session_manager.get_session_snapshot() and "image" in session_manager.get("pending_inquiry"):
-        # Only clear if it's a different image
-        pass
+    """
+    Run OCR on a pasted/uploaded image and show what was extracted.
     
-    if session_manager.get("image_processor"):
+    Returns the inquiry dict (prompt, client_name, extracted_text) to continue with,
+    or None if no usable inquiry could be extracted.
+    """
+    image_processor = load_image_processor()
+    if image_processor:
         # Handle different image input types
         try:
-            import io
-            
-            # Handle dictionary format from multimodal_chat_input
-            if isinstance(uploaded_image, dict):
-                # Extract image data from dictionary, Try common keys that might contain the image data
-                image_bytes = None
-                
-                # Check for Streamlit UploadedFile object in dict
-                if 'type' in uploaded_image and uploaded_image.get('type') == 'image':
-                    # Handle image type from multimodal component
-                    image_bytes = uploaded_image.get('content') or uploaded_image.get('data')
-                
-                # Try common keys
-                if not image_bytes:
-                    for key in ['data', 'content', 'bytes', 'file', 'image']:
-                        if key in uploaded_image:
-                            image_bytes = uploaded_image[key]
-                            break
-                
-                # If we found bytes, convert to PIL Image
-                if image_bytes:
-                    if isinstance(image_bytes, bytes):
-                        image = Image.open(io.BytesIO(image_bytes))
-                    elif hasattr(image_bytes, 'read'):
-                        # It's a file-like object
-                        image = Image.open(image_bytes)
-                    elif isinstance(image_bytes, Image.Image):
-                        # Already a PIL Image
-                        image = image_bytes
-                    else:
-                        # Try to convert to bytes if it's a string (base64 or data URI)
-                        import base64
-                        if isinstance(image_bytes, str):
-                            # Check if it's a data URI (data:image/png;base64,...)
-                            if image_bytes.startswith('data:image/'):
-                                # Parse data URI format: data:image/png;base64,<base64_data>
-                                try:
-                                    # Extract base64 data from data URI
-                                    header, encoded = image_bytes.split(',', 1)
-                                    # Extract file type from header (e.g., image/png)
-                                    file_type = header.split(';')[0].split('/')[1]  # Extract 'png' from 'data:image/png'
-                                    # Decode base64
-                                    image_data = base64.b64decode(encoded)
-                                    image = Image.open(io.BytesIO(image_data))
-                                except Exception as e:
-                                    raise ValueError(f"Failed to parse data URI: {str(e)}")
-                            else:
-                                # Try decoding as base64 string
-                                try:
-                                    image_data = base64.b64decode(image_bytes)
-                                    image = Image.open(io.BytesIO(image_data))
-                                except Exception:
-                                    # Not base64, try opening as file path
-                                    image = Image.open(image_bytes)
-                        else:
-                            # Debug: show what we got
-                            st.error(f"Debug: Image dict keys: {list(uploaded_image.keys())}")
-                            st.error(f"Debug: Image data type: {type(image_bytes)}")
-                            raise ValueError(f"Unsupported image data format in dict: {type(image_bytes)}")
-                else:
-                    # Debug: show dictionary structure
-                    st.error(f"Debug: Could not find image data. Dictionary keys: {list(uploaded_image.keys())}")
-                    st.error(f"Debug: Dictionary content preview: {str(uploaded_image)[:200]}")
-                    raise ValueError(f"Could not find image data in dictionary. Keys: {list(uploaded_image.keys())}")
-            elif hasattr(uploaded_image, 'read'):
-                # It's a file-like object (from file_uploader or native Streamlit)
-                image = Image.open(uploaded_image)
-            elif isinstance(uploaded_image, bytes):
-                # It's bytes from multimodal component
-                image = Image.open(io.BytesIO(uploaded_image))
-            elif isinstance(uploaded_image, str):
-                # Handle string input (could be data URI or file path)
-                import base64
-                if uploaded_image.startswith('data:image/'):
-                    # Parse data URI format: data:image/png;base64,<base64_data>
-                    try:
-                        header, encoded = uploaded_image.split(',', 1)
-                        # Extract file type from header (e.g., image/png -> png)
-                        file_type = header.split(';')[0].split('/')[1]
-                        # Decode base64
-                        image_data = base64.b64decode(encoded)
-                        image = Image.open(io.BytesIO(image_data))
-                    except Exception as e:
-                        raise ValueError(f"Failed to parse data URI: {str(e)}")
-                else:
-                    # Try opening as file path
-                    image = Image.open(uploaded_image)
-            else:
-                # Try to open directly (file path or PIL Image)
-                image = Image.open(uploaded_image)
+            image = normalize_image_input(uploaded_image)
             
             with st.spinner("📖 Reading image and extracting text..."):
                 # Display uploaded image in a nice container
@@ -353,7 +438,11 @@ def process_image(uploaded_image):
                 
                 with img_col2:
                     # Process image
-                    result = st.session_state.image_processor.process_image(image)
+                    result = run_ocr(image_processor, image)
+                    if result is None:
+                        # Still running: check again on a rerun instead of blocking this one
+                        time.sleep(OCR_POLL_INTERVAL)
+                        st.rerun()
                     
                     if result["success"]:
                         # Show extracted information in a compact, friendly format
@@ -391,24 +480,17 @@ def process_image(uploaded_image):
                                 st.warning("⚠️ No clear inquiry detected. Using full extracted text as inquiry.")
                             else:
                                 st.error("❌ Could not extract a valid inquiry from the image. Please ensure the text is clear and readable.")
-                                session_manager.stop_processing()
-                                st.stop()
-                                return
+                                return None
+                        
+                        st.balloons()  # Celebration for successful processing!
+                        st.success("🚀 Ready to generate response suggestions! Processing automatically...")
                         
-                        # Add to session state for processing
-                        pending_inquiry_dict = {
+                        # Hand the inquiry straight back to the caller instead of rerunning the script
+                        return {
                             "prompt": prompt.strip(),
                             "client_name": client_name,
-                            "image": image,
                             "extracted_text": result["extracted_text"]
                         }
-                        session_manager.set("pending_inquiry", pending_inquiry_dict)
-                        
-                        st.balloons()  # Celebration for successful processing!
-                        st.success("🚀 Ready to generate response suggestions! Processing automatically...")
-                        
-                        # Auto-process after a brief moment
-                        st.rerun()
                     else:
                         st.error(f"❌ Failed to process image: {result.get('error', 'Unknown error')}")
                         st.info("💡 Try a clearer image or check that the text is readable")
@@ -423,20 +505,16 @@ def handle_suggestion_selection():
     selected_option = session_manager.get("selected_response")
     
     if selected_option:
-        messages = session_manager.get("messages")
-        messages.append({
-            "role": "assistant",
-            "content": selected_option
-        })
-        session_manager.set("messages", messages)
-        
-        # Add to persisten conversation history
-        session_manager.get("conversation_manager").add_message(
-            conversation_id=session_manager.get("current_thread_id"),
-            sender="assistant",
-            message=selected_option,
-            # sources=suggestions_data.get("sources", [])
-        )
+        session_manager.append_message("assistant", selected_option)
+        
+        # Add to persisten conversation history, together with the turn's user message
+        pending = session_manager.get("pending_user_message")
+        conversation_id = pending["thread_id"] if pending else session_manager.get("current_thread_id")
+        messages = [("user", pending["message"])] if pending else []
+        messages.append(("assistant", selected_option))
+        session_manager.get("conversation_manager").add_messages(conversation_id, messages)
+        if pending:
+            session_manager.clear("pending_user_message")
         
         session_manager.set("current_suggestions", None)
         session_manager.clear("selected_response")
@@ -444,54 +522,72 @@ def handle_suggestion_selection():
     
         logger.info(f"Suggestion saved: {selected_option}")
         
+def flush_pending_user_message():
+    """Persist a user message that is still waiting for its reply."""
+    pending = session_manager.get("pending_user_message")
+    if pending:
+        session_manager.get("conversation_manager").add_message(pending["thread_id"], "user", pending["message"])
+        session_manager.clear("pending_user_message")
+        
+@st.cache_data(ttl=10, show_spinner=False)
+def get_vectorstore_info(_rag) -> Dict[str, Any]:
+    """Vector store info, cached briefly so reruns don't hit the store every time."""
+    return _rag.get_vectorstore_info()
+
 def render_sidebar():
     """Renders all UI components in the sidebar."""
     with st.sidebar:
-        if st.button("New Thread", use_container_width=True):
-            session_manager.set("current_thread_id", session_manager.get("conversation_manager").create_conversation_thread())
-            session_manager.set("messages", [])
-            st.rerun()
+        render_sidebar_threads()
+
+@st.fragment
+def render_sidebar_threads():
+    """Thread picker, rendered as a fragment so chat interactions don't rebuild it."""
+    if st.button("New Thread", use_container_width=True):
+        session_manager.set("current_thread_id", session_manager.get("conversation_manager").create_conversation_thread())
+        session_manager.set_messages([])
+        st.rerun()
+        
+    st.subheader("Conversation Threads")
+    threads = session_manager.get("conversation_manager").get_all_conversations(session_manager.get("user_id"))
+    if threads:
+        thread_options = {}
+        for t in threads:
+            topic = t.get('topic') or 'Untitled Conversation'
+            topic_display = topic.replace("\n", " ")
+            topic_display = topic_display[:50] + "..." if len(topic_display) > 50 else topic_display
+            msg_count = t.get('message_count', 0)
+            thread_options[f"{topic_display} ({msg_count} msgs)"] = t['thread_id']
             
-        st.subheader("Conversation Threads")
-        threads = session_manager.get("conversation_manager").get_all_conversations(session_manager.get("user_id"))
-        if threads:
-            thread_options = {}
-            for t in threads:
-                topic = t.get('topic') or 'Untitled Conversation'
-                topic_display = topic.replace("\n", " ")
-                topic_display = topic_display[:50] + "..." if len(topic_display) > 50 else topic_display
-                msg_count = t.get('message_count', 0)
-                thread_options[f"{topic_display} ({msg_count} msgs)"] = t['thread_id']
+        if thread_options:
+            current_index=0
+            current_values = list(thread_options.values())
+            if session_manager.get("current_thread_id") in current_values:
+                current_index = current_values.index(session_manager.get("current_thread_id"))
                 
-            if thread_options:
-                current_index=0
-                current_values = list(thread_options.values())
-                if session_manager.get("current_thread_id") in current_values:
-                    current_index = current_values.index(session_manager.get("current_thread_id"))
-                    
-                selected_thread_display = st.selectbox(
-                    "Switch to thread:",
-                    options=list(thread_options.keys()),
-                    index=current_index,
-                    key="thread_selectbos",
-                    help="Select a previous conversation thread"
-                )
-                
-                selected_id = thread_options.get(selected_thread_display)
-                if selected_id and selected_id != session_manager.get("current_thread_id"):
-                    session_manager.set("current_thread_id", selected_id)
-                    # Load thread messages
-                    thread_messages = session_manager.get("conversation_manager").get_conversation_history(selected_id)
-                    message_dict = [
-                        {"role": msg["sender"],
-                         "content": msg["message"],
-                         "sources":msg.get("sources", [])
-                        } for msg in thread_messages
-                    ]
-                    session_manager.set("messages", message_dict)
-                    st.rerun()
+            selected_thread_display = st.selectbox(
+                "Switch to thread:",
+                options=list(thread_options.keys()),
+                index=current_index,
+                key="thread_selectbos",
+                help="Select a previous conversation thread"
+            )
+            
+            selected_id = thread_options.get(selected_thread_display)
+            if selected_id and selected_id != session_manager.get("current_thread_id"):
+                session_manager.set("current_thread_id", selected_id)
+                # Load thread messages
+                thread_messages = session_manager.get("conversation_manager").get_conversation_history(selected_id)
+                message_dict = [
+                    {"role": msg["sender"],
+                     "content": msg["message"],
+                     "sources":msg.get("sources", [])
+                    } for msg in thread_messages
+                ]
+                session_manager.set_messages(message_dict)
+                # Full rerun so the chat tab shows the selected thread
+                st.rerun()
                     
-def render_document_tab():
+def render_document_tab(rag):
     """Renders the Document Upload tab UI."""
     with st.expander("Upload Documents", expanded=True):
         st.header("Upload Documents")
@@ -508,7 +604,7 @@ def render_document_tab():
             st.info(f"{len(uploaded_files)} file(s) selected")
             
             if st.button("Process Documents", type="primary"):
-                if process_uploaded_files(uploaded_files):
+                if process_uploaded_files(rag, uploaded_files):
                     st.success("Documents processed successfully!")
                     st.balloons()
                 else:
@@ -517,9 +613,21 @@ def render_document_tab():
         if session_manager.get("documents_processed"):
             st.success("Documents are ready for querying!")
 
-def display_chat_messages(messages):
-    """Displays all messages in the chat history."""
+@st.fragment
+def display_chat_messages(messages_version: int):
+    """
+    Displays all messages in the chat history.
+    
+    Rendered as a fragment so widget interactions inside the history only rerun this block;
+    `messages_version` changes whenever a message is added or the thread is switched.
+    """
+    messages = session_manager.get("messages")
     if messages:
+        # Only the latest messages are rendered by default; older ones are opt-in
+        hidden = len(messages) - RENDER_WINDOW
+        if hidden > 0 and not st.toggle(f"Show {hidden} earlier messages", key=f"show_earlier_{messages_version}"):
+            messages = messages[-RENDER_WINDOW:]
+            
         for message in messages:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
@@ -530,7 +638,7 @@ def render_chat_tab(rag):
     # Check if documents are processed/vectorstore is read
     if not session_manager.get("documents_processed"):
         if rag:
-            vs_info = rag.get_vectorstore_info()
+            vs_info = get_vectorstore_info(rag)
             if vs_info["status"] != "initialized" or vs_info.get("document_count", 0) == 0:
                 st.warning("Please upload and process documents first in the 'Upload Documents' section.")
                 return
@@ -554,7 +662,7 @@ def render_chat_tab(rag):
         st.caption(f"Thread: {thread_topic}")
         
     # --- Display Chat History ---
-    display_chat_messages(session_manager.get("messages"))
+    display_chat_messages(session_manager.get("messages_version", 0))
 
     # --- Display Suggestions (if any) ---
     current_suggestions = session_manager.get("current_suggestions")
@@ -616,6 +724,11 @@ def render_chat_tab(rag):
                     label_visibility="collapsed"
                 )
                 
+    # A pending OCR job resumes its turn; the chat input is empty on the rerun
+    ocr_job = session_manager.get("ocr_job")
+    if uploaded_image is None and not prompt and ocr_job:
+        uploaded_image = ocr_job["image"]
+    
     # Start processing only if there is input
     if (uploaded_image is not None or (prompt and len(prompt.strip()) > 0)):
         session_manager.start_processing()
@@ -624,23 +737,20 @@ def render_chat_tab(rag):
 def handle_chat_input(rag, prompt, uploaded_image):
     """Core logic for processing image, handling prompt, generating response suggestions, and rerunning."""
     
-    # Image Processing
-    if uploaded_image is not None:
-        process_image(uploaded_image)
-        # Rerun is triggered inside process_image if successful
-        return
-    
-    # Handle Pending Inquiry from successful image processing
     client_name = None
     image_processed = False
     
-    if session_manager.get("pending_inquiry"):
-        inquiry_data = session_manager.get("pending_inquiry")
+    # Image Processing: continue with the extracted inquiry in this same run
+    if uploaded_image is not None:
+        inquiry_data = process_image(uploaded_image)
+        if not inquiry_data:
+            session_manager.stop_processing()
+            return
+        
         prompt = inquiry_data.get("prompt", "").strip()
         client_name = inquiry_data.get("client_name")
         extracted_text = inquiry_data.get("extracted_text", "").strip()
         image_processed = True
-        session_manager.clear("pending_inquiry") # Clear after reading
         
         if not prompt or len(prompt.strip()) < 5:
             if extracted_text and len(extracted_text) > 10:
@@ -659,30 +769,28 @@ def handle_chat_input(rag, prompt, uploaded_image):
     if not session_manager.get("current_thread_id"):
         session_manager.set("current_thread_id", session_manager.get("conversation_manager").create_conversation_thread())
         
-    user_message = prompt
     if client_name:
         user_message = f"Client: {client_name}\n\nInquiry: {prompt}"
-        
-    session_manager.get("conversation_manager").add_message(session_manager.get("current_thread_id"), "user", user_message)
-    
-    display_message = prompt
-    if client_name:
         display_message = f"**{client_name}** asks: {prompt}"
+        echo_message = f"**Client:** {client_name}\n\n{prompt}"
+    else:
+        user_message = display_message = echo_message = prompt
         
-    messages = session_manager.get("messages")
-    messages.append({
-        "role": "user", "content": display_message
+    # The user message is written with the selected reply in one transaction;
+    # a turn that never got a reply is flushed on its own first
+    flush_pending_user_message()
+    session_manager.set("pending_user_message", {
+        "thread_id": session_manager.get("current_thread_id"),
+        "message": user_message
     })
-    session_manager.set("messages", messages)
+    session_manager.append_message("user", display_message)
     
     # Display the user message immediately
     with st.chat_message("user"):
-        if client_name:
-            st.markdown(f"**Client:** {client_name}")
-        st.markdown(prompt)
+        st.markdown(echo_message)
     
     # Generate Response Suggestions
-    if rag and rag.qa_chain:
+    if rag and rag.ready:
         with st.chat_message("assistant"):
             with st.spinner("Generating response suggestions..."):
                 
@@ -691,53 +799,44 @@ def handle_chat_input(rag, prompt, uploaded_image):
                     session_manager.set("regenerate_response", False)
                     st.info("Regenerating fresh response (bypassing cache)...")
                     
-                conversation_context = session_manager.get("conversation_manager").get_thread_context(
+                conversation_manager = session_manager.get("conversation_manager")
+                num_suggestions = 2
+                
+                # Embed the prompt while the thread history is read from the database
+                pending_embedding = prefetch_prompt_embedding(rag, prompt)
+                conversation_context = conversation_manager.get_thread_context(
                     session_manager.get("current_thread_id")
                 )
-                num_suggestions = 2
-                result = None
                 
-                try:
-                    # Attempt primary generation
-                    if image_processed:
-                        st.info("Generating personalized response suggestions...")
-                        
-                    result = rag.generate_response_suggestions(
-                        question=prompt,
-                        client_name=client_name,
-                        conversation_context=conversation_context,
-                        num_suggestions=num_suggestions
-                    )
-                    
-                    if not result or not result.get("suggestions"):
-                        raise Exception("No suggestions generated.")
-                except Exception as e:
-                    logger.error(f"Error during primary generation: {str(e)}")
-                    st.warning("Primary generation failed. Trying fallback method...")
-                    
-                    try:
-                        # Fallback to regular query
-                        fallback_result = rag.query(prompt, conversation_context=conversation_context)
-                        if fallback_result.get("answer"):
-                            result = {
-                                "suggestions": [fallback_result["answer"]],
-                                "source_documents": fallback_result.get("source_documents", []),
-                                "cached": False
-                            }
-                        else:
-                            raise Exception("Fallback also failed.")
-                    except Exception as e2:
-                        st.error(f"Fallback also failed: {str(e2)}")
+                # Cached answers are generic: they are only stored for and served to turns
+                # without a client name or earlier thread history
+                use_cache = (
+                    session_manager.get("use_cache", True)
+                    and not regenerate_requested
+                    and not client_name
+                    and not conversation_context
+                )
+                cached = conversation_manager.find_similar_question(prompt, conversation_context=conversation_context) if use_cache else None
+                
+                if cached:
+                    st.info("💾 Using cached answer")
+                    result = cached_result(cached)
+                else:
+                    result = run_generation(rag, prompt, client_name, conversation_context, pending_embedding, num_suggestions, image_processed, use_cache)
+                    if result is None:
                         session_manager.stop_processing()
                         st.stop()
                         return
                     
-                # Store and Display Suggestions
+                # Store and Display Suggestions: only what the suggestion block renders
+                # is kept, the inquiry itself already lives in the message history
                 session_manager.set("current_suggestions", {
                     "suggestions": result.get("suggestions", []),
-                    "sources": result.get("source_documents", []),
-                    "client_name": client_name,
-                    "inquiry": prompt
+                    "sources": [
+                        (source.get("display_name", source.get("source", "Document")), source.get("preview", ""))
+                        for source in result.get("source_documents", [])
+                    ],
+                    "client_name": client_name
                 })
                 
                 session_manager.stop_processing()
@@ -747,6 +846,118 @@ def handle_chat_input(rag, prompt, uploaded_image):
         st.error("RAG systems not ready. Please check you configuration.")
         session_manager.stop_processing()
         
+def cached_result(entry):
+    """Result dictionary of a turn answered from the question cache."""
+    answer = entry.answer
+    return {
+        "suggestions": answer if isinstance(answer, list) else [answer],
+        "source_documents": entry.source_documents,
+        "cached": True
+    }
+
+def run_generation(rag, prompt, client_name, conversation_context, pending_embedding, num_suggestions, image_processed, use_cache=False):
+    """
+    Cache-miss path of a turn: generate suggestions and cache them.
+    
+    use_cache must only be set for turns without thread context, since cached
+    answers are served to any thread.
+    
+    Returns the result dictionary, or None if generation and fallback both failed.
+    """
+    conversation_manager = session_manager.get("conversation_manager")
+    
+    prompt_embedding = get_prompt_embedding(rag, prompt, pending_embedding)
+    
+    # A paraphrase of an earlier question reuses its answer
+    if use_cache and prompt_embedding is not None:
+        cached = conversation_manager.find_similar_question(prompt, embedding=prompt_embedding, conversation_context=conversation_context)
+        if cached:
+            st.info("💾 Using cached answer (similar question)")
+            return cached_result(cached)
+    
+    result = generate_suggestions(rag, prompt, client_name, conversation_context, num_suggestions, image_processed)
+    if result and use_cache:
+        conversation_manager.cache_answer(prompt, result["suggestions"], result.get("source_documents", []), embedding=prompt_embedding, conversation_context=conversation_context)
+    return result
+
+@st.cache_resource
+def get_query_pool() -> ThreadPoolExecutor:
+    """Process-wide thread pool for query work that can overlap with other I/O in a turn."""
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="query")
+
+def prefetch_prompt_embedding(rag, prompt):
+    """Start embedding the prompt in the background; returns None if it is already stored."""
+    last = session_manager.get("last_prompt_emb")
+    if last and last["prompt"] == prompt:
+        return None
+    return get_query_pool().submit(rag.embed_query, prompt)
+
+def get_prompt_embedding(rag, prompt, pending=None):
+    """Embed the prompt once per turn; regenerating the same prompt reuses the last embedding."""
+    last = session_manager.get("last_prompt_emb")
+    if last and last["prompt"] == prompt:
+        return last["embedding"]
+    
+    try:
+        embedding = pending.result() if pending else rag.embed_query(prompt)
+    except Exception as e:
+        logger.error(f"Error embedding prompt: {str(e)}")
+        return None
+    
+    session_manager.set("last_prompt_emb", {"prompt": prompt, "embedding": embedding})
+    return embedding
+        
+def generate_suggestions(rag, prompt, client_name, conversation_context, num_suggestions, image_processed):
+    """Generate response suggestions, falling back to a plain query. Returns None if both fail."""
+    try:
+        # Attempt primary generation
+        if image_processed:
+            st.info("Generating personalized response suggestions...")
+            
+        # Stream the raw LLM output so the first tokens show up immediately
+        token_stream, sources = rag.generate_response_suggestions_stream(
+            question=prompt,
+            client_name=client_name,
+            conversation_context=conversation_context,
+            num_suggestions=num_suggestions,
+            query_embedding=get_prompt_embedding(rag, prompt)
+        )
+        answer_text = st.write_stream(token_stream)
+        result = rag.finalize_response_suggestions(answer_text, sources, prompt, client_name, num_suggestions)
+        
+        if not result or not result.get("suggestions"):
+            raise Exception("No suggestions generated.")
+        return result
+    except Exception as e:
+        logger.error(f"Error during primary generation: {str(e)}")
+        st.warning("Primary generation failed. Trying fallback method...")
+        
+    try:
+        # Fallback to regular query
+        fallback_result = rag.query(prompt, conversation_context=conversation_context, query_embedding=get_prompt_embedding(rag, prompt))
+        if fallback_result.get("answer"):
+            return {
+                "suggestions": [fallback_result["answer"]],
+                "source_documents": fallback_result.get("source_documents", []),
+                "cached": False
+            }
+        raise Exception("Fallback also failed.")
+    except Exception as e2:
+        st.error(f"Fallback also failed: {str(e2)}")
+        return None
+        
+    
+def request_regeneration():
+    """
+    Button callback: drop the current suggestions and flag a fresh generation.
+    
+    Runs before the click's rerun, so that rerun already sees the new state
+    and no second st.rerun() is needed.
+    """
+    session_manager.set("regenerate_response", True)
+    session_manager.clear("current_suggestions")
+    session_manager.clear("selected_response")
+    
 def display_suggestions(current_suggestions, rag):
     """Displays the response suggestions and selection mechanism."""
     
@@ -763,11 +974,7 @@ def display_suggestions(current_suggestions, rag):
         else:
             st.caption("Choose a response to send to the client:")
     with regen_col2:
-        if st.button("Regenerate", key="regenerate_top", use_container_width="True", help="Generate new response variations"):
-            session_manager.set("regenerate_response", True)
-            session_manager.clear("current_suggestions")
-            session_manager.clear("selected_response")
-            st.rerun()
+        st.button("Regenerate", key="regenerate_top", use_container_width="True", help="Generate new response variations", on_click=request_regeneration)
             
     # Radio button selection
     st.radio(
@@ -784,22 +991,16 @@ def display_suggestions(current_suggestions, rag):
     # Source documents expander
     if current_suggestions["sources"]:
         with st.expander("Reference Documents"):
-            for i, source in enumerate(current_suggestions["sources"], 1):
-                doc_name = source.get("source", "Document").replace("_", " ").replace("-", " ").title()
-                st.markdown(f"**{doc_name}**")
-                if source.get("content"):
-                    preview = source["content"][:200] + "..." if len(source["content"]) > 200 else source["content"]
+            for display_name, preview in current_suggestions["sources"]:
+                st.markdown(f"**{display_name}**")
+                if preview:
                     st.caption(preview)
     
     # Bottom Regenerate button
     st.markdown("---")
     regen_bottom_col1, regen_bottom_col2, regen_bottom_col3 = st.columns([2, 1, 1])
     with regen_bottom_col2:
-        if st.button("Regenerate All", key="regenerate_bottom", use_container_width=True, help="Generate completely new response variations"):
-            session_manager.set("regenerate_response", True)
-            session_manager.clear("current_suggestions")
-            session_manager.clear("selected_response")            
-            st.rerun()
+        st.button("Regenerate All", key="regenerate_bottom", use_container_width=True, help="Generate completely new response variations", on_click=request_regeneration)
     
 def main():
     """Main application function."""
@@ -833,6 +1034,7 @@ def main():
         st.toast("Logged in successfully!", icon="✅", duration="short")
         with logout_col:
             if st.button("Logout"):
+                flush_pending_user_message()
                 session_manager.set("authenticated", False)
                 session_manager.logged_out()
                 session_manager.get("conversation_manager").disconnect_user()
@@ -841,7 +1043,8 @@ def main():
                     cookies.save()
                 st.rerun()
         
-        rag = initialize_rag_system()
+        # Built once per session; later reruns just read the stored handle
+        rag = session_manager.get("rag_system") or initialize_rag_system()
         # Sidebar rendering
         render_sidebar()
         
@@ -849,7 +1052,7 @@ def main():
         tab1, tab2 = st.tabs(["Upload Documents", "Chat with Documents"])
         
         with tab1:
-            render_document_tab()
+            render_document_tab(rag)
         
         with tab2:
             render_chat_tab(rag)
@@ -3,25 +3,13 @@ import streamlit as st
 import os
 import multiprocessing
 from pathlib import Path
-from src.rag_system import RAGSystem
 from src.conversation_management import ConversationManager
-from PIL import Image
+from src.session_management import get_question_cache, get_rag_system
 import src.config as config
 
 # Set environment variable to avoid OpenMP warning (needed for EasyOCR/numpy)
 os.environ.setdefault('KMP_DUPLICATE_LIB_OK', 'TRUE')
 
-# Import image processor after setting environment variable
-from src.image_processor import ImageProcessor
-
-# Try multimodal component first (supports Ctrl+V paste), fallback to native Streamlit
-try:
-    from st_chat_input_multimodal import multimodal_chat_input
-    MULTIMODAL_AVAILABLE = True
-except ImportError:
-    MULTIMODAL_AVAILABLE = False
-    multimodal_chat_input = None
-
 # Page configuration
 st.set_page_config(
     page_title=config.PAGE_TITLE,
@@ -37,30 +25,54 @@ if "messages" not in st.session_state:
 if "documents_processed" not in st.session_state:
     st.session_state.documents_processed = False
 if "conversation_manager" not in st.session_state:
-    st.session_state.conversation_manager = ConversationManager()
+    st.session_state.conversation_manager = ConversationManager(question_cache=get_question_cache())
 if "current_thread_id" not in st.session_state:
     st.session_state.current_thread_id = None
 if "use_cache" not in st.session_state:
     st.session_state.use_cache = True
-if "image_processor" not in st.session_state:
-    try:
-        st.session_state.image_processor = ImageProcessor()
-    except Exception as e:
-        st.session_state.image_processor = None
 if "pasted_image" not in st.session_state:
     st.session_state.pasted_image = False
 if "regenerate_response" not in st.session_state:
     st.session_state.regenerate_response = False
 
 
+# CPU count is constant for the lifetime of the process
+CPU_COUNT = multiprocessing.cpu_count()
+WORKER_COUNT = config.MAX_WORKERS if config.MAX_WORKERS > 0 else CPU_COUNT
+
+# Info cards only depend on config, so build them once at import
+MODEL_INFO_MD = (
+    f"**LLM:** {config.OLLAMA_MODEL}  \n"
+    f"**Embeddings:** {config.EMBEDDING_MODEL}  \n"
+    f"**API:** {config.OLLAMA_BASE_URL}  "
+)
+SETTINGS_MD = (
+    f"**Chunk Size:** {config.CHUNK_SIZE}  \n"
+    f"**Top-K:** {config.TOP_K}  \n"
+    f"**Max Tokens:** {config.MAX_TOKENS}  \n"
+    f"**Temperature:** {config.TEMPERATURE}  "
+)
+PERFORMANCE_MD = (
+    f"**CPU Cores:** {CPU_COUNT}  \n"
+    f"**Parallel Processing:** {'Enabled' if config.PARALLEL_PROCESSING else 'Disabled'}  \n"
+    f"**Workers:** {WORKER_COUNT}  \n"
+    f"**Batch Size:** {config.BATCH_SIZE}  \n"
+    f"**Context Size:** {config.CONTEXT_SIZE}  "
+)
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def get_vectorstore_info(_rag):
+    """Vector store info, cached briefly so reruns don't hit the store every time."""
+    return _rag.get_vectorstore_info()
+
+
 def initialize_rag_system():
     """Initialize the RAG system."""
     try:
         if st.session_state.rag_system is None:
-            with st.spinner("Initializing RAG system..."):
-                st.session_state.rag_system = RAGSystem()
-                # Try to load existing vector store
-                st.session_state.rag_system.load_vectorstore()
+            # Shared with the chat page, so both run on the same models and store
+            st.session_state.rag_system = get_rag_system()
         return st.session_state.rag_system
     except Exception as e:
         st.error(f"Failed to initialize RAG system: {str(e)}")
@@ -75,7 +87,7 @@ def main():
     st.subheader("System Status")
     rag = initialize_rag_system()
     if rag:
-        vs_info = rag.get_vectorstore_info()
+        vs_info = get_vectorstore_info(rag)
         if vs_info["status"] == "initialized":
             st.success(f"✅ Vector Store: {vs_info['document_count']} chunks")
         else:
@@ -86,29 +98,13 @@ def main():
     cols1 = st.columns(3)
     # Model info
     cols1[0].subheader("Model Information")
-    cols1[0].info(f"""
-                  **LLM:** {config.OLLAMA_MODEL}  
-                  **Embeddings:** {config.EMBEDDING_MODEL}  
-                  **API:** {config.OLLAMA_BASE_URL}  
-                  """)
+    cols1[0].info(MODEL_INFO_MD)
     # Settings
     cols1[1].subheader("Settings")
-    cols1[1].info(f"""
-            **Chunk Size:** {config.CHUNK_SIZE}  
-            **Top-K:** {config.TOP_K}  
-            **Max Tokens:** {config.MAX_TOKENS}  
-            **Temperature:** {config.TEMPERATURE}  
-            """)
+    cols1[1].info(SETTINGS_MD)
     # Performance Settings
     cols1[2].subheader("Performance")
-    cpu_count = multiprocessing.cpu_count()
-    cols1[2].info(f"""
-                  **CPU Cores:** {cpu_count}  
-                  **Parallel Processing:** {'Enabled' if config.PARALLEL_PROCESSING else 'Disabled'}  
-                  **Workers:** {config.MAX_WORKERS if config.MAX_WORKERS > 0 else cpu_count}  
-                  **Batch Size:** {config.BATCH_SIZE}  
-                  **Context Size:** {config.CONTEXT_SIZE}  
-                  """)
+    cols1[2].info(PERFORMANCE_MD)
 
     # Cache settings
     st.subheader("Memory & Cache")
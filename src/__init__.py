@@ -1 +1 @@
-__all__ = ["config", "conversation_management", "document_processor", "image_processor", "rag_system", "session_management", "sqlite_manager", "user_management", "vectorstore_manager"]
\ No newline at end of file
+__all__ = ["config", "conversation_management", "document_processor", "image_processor", "rag_system", "semantic_cache", "session_management", "sqlite_manager", "user_management", "vectorstore_manager"]
\ No newline at end of file
@@ -0,0 +1,16 @@
+
+(function() {
+        return new Promise((resolve) => {
+            const handler = (event) => {
+                if (event.data.type === 'fingerprint') {
+                    window.removeEventListener('message', handler);
+                    resolve(event.data);
+                }
+            };
+            window.addEventListener('message', handler);
+            setTimeout(() => {
+                window.removeEventListener('message', handler);
+                resolve({error: 'timeout'});
+            }, 5000);  // 5s timeout
+        });
+    })();
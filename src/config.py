@@ -2,15 +2,18 @@
 Configuration settings for the RAG system.
 """
 import os
+from functools import lru_cache
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
 
-USE_OLLAMA = True
+USE_OLLAMA = os.getenv("USE_OLLAMA", "1") == "1"  # 0 = use Gemini
 
 # Ollama Configuration
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://127.0.0.1:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "-1")  # Keep the model (and its prompt cache) loaded; -1 = forever
 
 # Gemini Configuration
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY")
@@ -19,6 +22,9 @@ GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 # Embedding Configuration
 # Note: DeepSeek R1 8B doesn't support embeddings, so we use a dedicated embedding model
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text-v1.5")
+EMBEDDING_INFERENCE_MODE = os.getenv("EMBEDDING_INFERENCE_MODE", "remote")  # remote = Nomic API, local = quantized model on this machine, dynamic = pick per request
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE") or None  # Local mode only, e.g. "gpu" or "cpu" (default: let GPT4All choose)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "256"))  # Recent query embeddings kept in memory (0 = off)
 
 # Document Processing Configuration
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1500"))  # Larger chunks = fewer chunks to process
@@ -43,30 +49,25 @@ PARALLEL_PROCESSING = os.getenv("PARALLEL_PROCESSING", "true").lower() == "true"
 THREAD_COUNT = int(os.getenv("THREAD_COUNT", "0"))  # 0 = use all available CPU threads
 
 # Vector Store Configuration
-if USE_OLLAMA:
-    # Vector Store Configuration
-    VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", "./database")
-    PERSIST_DIRECTORY = os.path.join(VECTORSTORE_DIR, "vectorstore")
-else: 
-    VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", "./database")
-    PERSIST_DIRECTORY = os.path.join(VECTORSTORE_DIR, "vectorstore")
+VECTORSTORE_DIR = os.getenv("VECTORSTORE_DIR", "./database")
+PERSIST_DIRECTORY = os.path.join(VECTORSTORE_DIR, "vectorstore")
 
 # SQLite Configuration
-if USE_OLLAMA:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-else:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-    
-if USE_OLLAMA:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-else:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-    
-if USE_OLLAMA:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-else:
-    DB_PATH = "./database/structured/rag_chatbot.db"
-    
+DB_PATH = "./database/structured/rag_chatbot.db"
+
+# Write JSON stores indented, for debugging (compact otherwise)
+CACHE_PRETTY = os.getenv("CACHE_PRETTY", "0") == "1"
+
+# Question Answer Cache Configuration (same or reworded questions by shared words)
+QUESTION_CACHE_TTL = int(os.getenv("QUESTION_CACHE_TTL", "86400"))  # Seconds an answer stays valid
+QUESTION_CACHE_SIZE = int(os.getenv("QUESTION_CACHE_SIZE", "1000"))  # Entries kept (oldest evicted)
+
+# Semantic lookup in the question cache (reworded questions by embedding)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # Minimum cosine similarity for a hit
+
+# OCR Configuration
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "1600"))  # Longest image side fed to the text detector (px)
+
 # File Upload Configuration
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "./data/uploads")
 MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", "50"))  # MB
@@ -80,36 +81,18 @@ USER_AGENT = os.environ.get("USER_AGENT")
 
 SESSION_TIMEOUT = 60 * 60 # 1 hour
 
-FINGERPRINT_JS = """
-<script src="https://openfpcdn.io/fingerprintjs/v4"></script>
-    <script>
-    async function getFingerprint() {
-        try {
-            const fp = await FingerprintJS.load();
-            const result = await fp.get();
-            window.parent.postMessage({type: 'fingerprint', visitorId: result.visitorId}, '*');
-        } catch (error) {
-            window.parent.postMessage({type: 'fingerprint', error: error.message}, '*');
-        }
-    }
-    getFingerprint();  // Run immediately
-    </script>
-"""
-
-LISTENER_JS = """
-(function() {
-        return new Promise((resolve) => {
-            const handler = (event) => {
-                if (event.data.type === 'fingerprint') {
-                    window.removeEventListener('message', handler);
-                    resolve(event.data);
-                }
-            };
-            window.addEventListener('message', handler);
-            setTimeout(() => {
-                window.removeEventListener('message', handler);
-                resolve({error: 'timeout'});
-            }, 5000);  // 5s timeout
-        });
-    })();
-"""
\ No newline at end of file
+# Browser snippets live in src/assets and are read on first access (see __getattr__)
+_ASSETS = {
+    "FINGERPRINT_JS": "fingerprint.html",
+    "LISTENER_JS": "listener.js",
+}
+
+@lru_cache(maxsize=None)
+def load_asset(name: str) -> str:
+    """Read a file from src/assets once per process."""
+    return (Path(__file__).parent / "assets" / name).read_text(encoding="utf-8")
+
+def __getattr__(name: str):
+    if name in _ASSETS:
+        return load_asset(_ASSETS[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -4,44 +4,381 @@ Conversation management with memory, caching, and threading.
 import json
 import os
 import hashlib
-from typing import Dict, List, Optional
+import math
+import mmap
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
 from datetime import datetime
 import src.config as config
 import uuid
 from src.utils.logger import AppLogger
+from src.sqlite_manager import SQLiteManager
+from src.semantic_cache import SemanticCache
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
 
 logger = AppLogger(name="conversation_manager")
 
+# Hex length of the question cache keys (64-bit BLAKE2b)
+QUESTION_HASH_LENGTH = 16
+
+def _dumps(obj) -> bytes:
+    """Serialize to compact UTF-8 JSON (indented with CACHE_PRETTY=1), with orjson when it is installed."""
+    if ORJSON_AVAILABLE:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if config.CACHE_PRETTY else 0)
+        return orjson.dumps(obj, option=option)
+    if config.CACHE_PRETTY:
+        return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _load_file(path: str):
+    """
+    Parse a UTF-8 JSON file.
+    
+    With orjson the file is memory-mapped and parsed in place, so no bytes
+    copy of the whole file is made first.
+    """
+    with open(path, 'rb') as f:
+        if ORJSON_AVAILABLE:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return orjson.loads(view)
+        return json.loads(f.read())
+
+@dataclass(slots=True)
+class CacheEntry:
+    """One cached answer; stored as a row of the question_cache table."""
+    question: str
+    answer: Any
+    source_documents: List[Dict] = field(default_factory=list)
+    # Epoch seconds
+    timestamp: float = 0.0
+    # Normalized words, so loading the cache doesn't re-split every question
+    tokens: List[str] = field(default_factory=list)
+    # Interned word ids used by the similarity search (not persisted)
+    token_ids: frozenset = field(default=frozenset(), repr=False, compare=False)
+    
+    @classmethod
+    def from_row(cls, row: Dict) -> "CacheEntry":
+        """Build an entry from a question_cache row."""
+        return cls(
+            question=row["question"],
+            answer=row["answer"],
+            source_documents=row["source_documents"],
+            timestamp=row["created_at"] or 0.0,
+            tokens=row["tokens"],
+        )
+    
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CacheEntry":
+        """Build an entry from an object of the legacy question_cache.json."""
+        timestamp = data.get("timestamp")
+        if isinstance(timestamp, str):
+            try:
+                timestamp = datetime.fromisoformat(timestamp).timestamp()
+            except ValueError:
+                timestamp = None
+        return cls(
+            question=data.get("question", ""),
+            answer=data.get("answer"),
+            source_documents=data.get("source_documents") or [],
+            timestamp=timestamp or time.time(),
+            tokens=data.get("tokens") or [],
+        )
+    
+    def to_row(self, question_hash: str) -> Tuple:
+        """Values for SQLiteManager.put_cached_answers."""
+        return (question_hash, self.question, self.answer, self.source_documents, self.tokens, self.timestamp)
+
+
+class QuestionCache:
+    """
+    Answer cache keyed on question similarity, persisted to the question_cache table.
+    
+    Questions are matched by shared words and, when the caller has the query
+    embedding, by cosine similarity through an in-memory SemanticCache index
+    (refilled as answers are cached; embeddings are not persisted).
+    Entries are held in memory for the similarity search; each insert writes
+    only its own row. Answers expire after ttl seconds and only the newest
+    max_entries are kept, in memory and in the table. One instance is meant to
+    be shared by every session in the process, so lookups and inserts are
+    guarded by a lock.
+    """
+    
+    def __init__(self, db: SQLiteManager, cache_dir: str = "./cache", ttl: float = None, max_entries: int = None):
+        """
+        Load the live cached answers and build the word index.
+        
+        Args:
+            db: Database holding the question_cache table
+            cache_dir: Directory of a legacy question_cache.json to import once
+            ttl: Seconds an answer stays valid (default from config)
+            max_entries: Answers kept before the oldest is evicted (default from config)
+        """
+        self.db = db
+        self.ttl = ttl if ttl is not None else config.QUESTION_CACHE_TTL
+        self.max_entries = max_entries if max_entries is not None else config.QUESTION_CACHE_SIZE
+        self._lock = threading.Lock()
+        # Embedding index over the same entries, keyed by question hash
+        self.semantic = SemanticCache(ttl=self.ttl, max_entries=self.max_entries)
+        
+        # Oldest first, so eviction pops from the front
+        min_created_at = time.time() - self.ttl
+        try:
+            self.db.prune_cached_answers(min_created_at, self.max_entries)
+        except Exception as e:
+            logger.error(f"Error pruning cache: {e}")
+        self.entries: Dict[str, CacheEntry] = {
+            row["hash"]: CacheEntry.from_row(row)
+            for row in self.db.get_cached_answers(min_created_at, self.max_entries)
+        }
+        if not self.entries:
+            self.entries = self._import_legacy_file(os.path.join(cache_dir, "question_cache.json"))
+        # Inverted index (word id -> question hashes) so similarity lookups only
+        # visit entries sharing at least one word with the query. Words are
+        # interned to small ints so each entry keeps a compact id set.
+        self._vocabulary: Dict[str, int] = {}
+        self._token_index: Dict[int, Set[str]] = {}
+        for question_hash, entry in self.entries.items():
+            if not entry.tokens:
+                entry.tokens = self._words(entry.question)
+            self._index_entry(question_hash, entry)
+    
+    def _import_legacy_file(self, cache_file: str) -> Dict[str, CacheEntry]:
+        """Move the entries of an old question_cache.json into the database."""
+        if not os.path.exists(cache_file):
+            return {}
+        try:
+            data = _load_file(cache_file)
+        except Exception:
+            return {}
+        
+        # Re-keyed, since old files may use MD5 keys; expired answers are dropped
+        entries = {}
+        min_created_at = time.time() - self.ttl
+        items = sorted((CacheEntry.from_dict(item) for item in data.values()), key=lambda entry: entry.timestamp)
+        for entry in items[-self.max_entries:] if self.max_entries > 0 else []:
+            if entry.timestamp < min_created_at:
+                continue
+            if not entry.tokens:
+                entry.tokens = self._words(entry.question)
+            entries[self._hash_question(entry.question)] = entry
+        try:
+            self.db.put_cached_answers([entry.to_row(question_hash) for question_hash, entry in entries.items()])
+            os.replace(cache_file, cache_file + ".migrated")
+            logger.info(f"Imported {len(entries)} cached answers from {cache_file}")
+        except Exception as e:
+            logger.error(f"Failed to import {cache_file}: {e}")
+        return entries
+    
+    def _hash_question(self, question: str) -> str:
+        """Create a hash for a question (normalized)."""
+        # Normalize question: lowercase, remove extra spaces
+        normalized = " ".join(question.lower().split())
+        # Non-cryptographic key: a 64-bit BLAKE2b digest is cheaper than MD5 on short inputs
+        return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+    
+    def _words(self, question: str) -> List[str]:
+        """Normalized words of a question (lowercase, whitespace-split, deduplicated)."""
+        return list(set(question.lower().split()))
+    
+    def _tokenize(self, words: List[str], add: bool = False) -> frozenset:
+        """
+        Word-id set for normalized words.
+        
+        Unknown words get a new id when add is True; otherwise they get a
+        negative placeholder id, which counts towards the union size but
+        matches no cached entry.
+        """
+        ids = set()
+        for word in words:
+            word_id = self._vocabulary.get(word)
+            if word_id is None:
+                if add:
+                    word_id = self._vocabulary[word] = len(self._vocabulary)
+                else:
+                    word_id = -1 - len(ids)
+            ids.add(word_id)
+        return frozenset(ids)
+    
+    def _index_entry(self, question_hash: str, entry: CacheEntry):
+        """Add a cached question's normalized words to the inverted word index."""
+        entry.token_ids = tokens = self._tokenize(entry.tokens, add=True)
+        for token in tokens:
+            self._token_index.setdefault(token, set()).add(question_hash)
+    
+    def _unindex_entry(self, question_hash: str, entry: CacheEntry):
+        """Remove a cached question from the inverted word index."""
+        for token in entry.token_ids:
+            bucket = self._token_index.get(token)
+            if bucket is not None:
+                bucket.discard(question_hash)
+                if not bucket:
+                    del self._token_index[token]
+    
+    def _remove(self, question_hash: str):
+        """Drop an entry from memory; the caller holds the lock."""
+        entry = self.entries.pop(question_hash, None)
+        if entry is not None:
+            self._unindex_entry(question_hash, entry)
+        self.semantic.discard(question_hash)
+    
+    def _is_expired(self, entry: CacheEntry) -> bool:
+        """Whether an entry is older than the TTL."""
+        return time.time() - entry.timestamp > self.ttl
+    
+    def find_similar_question(self, question: str, threshold: float = 0.9, embedding: List[float] = None) -> Optional[CacheEntry]:
+        """
+        Find a cached answer for the same or a similar question.
+        
+        Exact matches are found by hash; otherwise the Jaccard similarity of the
+        word sets is computed for entries sharing at least one word with the query.
+        If that misses and an embedding is given, reworded questions are looked
+        up by embedding.
+        
+        Args:
+            question: User's question
+            threshold: Minimum Jaccard similarity for a cache hit
+            embedding: Optional query embedding for the semantic lookup
+            
+        Returns:
+            Cached entry or None
+        """
+        question_hash = self._hash_question(question)
+        with self._lock:
+            entry = self.entries.get(question_hash) or self._find_similar(question, threshold)
+            if entry is None and embedding is not None:
+                entry = self.semantic.get(embedding)
+                if entry is not None:
+                    logger.info(f"Semantic cache hit for: {question[:80]}")
+            if entry is not None and self._is_expired(entry):
+                self._remove(self._hash_question(entry.question))
+                return None
+            return entry
+    
+    def _find_similar(self, question: str, threshold: float) -> Optional[CacheEntry]:
+        """Jaccard lookup over the inverted index; the caller holds the lock."""
+        query_tokens = self._tokenize(self._words(question))
+        if not query_tokens:
+            return None
+        
+        # A match needs |q & c| >= threshold * |q|, so any (|q| - ceil(threshold * |q|) + 1)
+        # query words include at least one word of every match. Probing only the
+        # rarest ones keeps common words from pulling in the whole cache on a miss.
+        query_size = len(query_tokens)
+        prefix_length = query_size - math.ceil(threshold * query_size - 1e-9) + 1
+        rarest = sorted(query_tokens, key=lambda token: len(self._token_index.get(token, ())))
+        candidates = set()
+        for token in rarest[:prefix_length]:
+            candidates.update(self._token_index.get(token, ()))
+        
+        # Jaccard >= threshold is only reachable when the set sizes are within
+        # a factor of threshold of each other, so skip the rest without intersecting
+        min_size, max_size = query_size * threshold, query_size / threshold
+        best_hash, best_score = None, 0.0
+        for candidate in candidates:
+            cached_tokens = self.entries[candidate].token_ids
+            cached_size = len(cached_tokens)
+            if cached_size < min_size or cached_size > max_size:
+                continue
+            # Size ratio is also an upper bound on the score; skip if it can't beat the best
+            if min(query_size, cached_size) / max(query_size, cached_size) <= best_score:
+                continue
+            shared = len(query_tokens & cached_tokens)
+            similarity = shared / (query_size + cached_size - shared)
+            if similarity > best_score:
+                best_hash, best_score = candidate, similarity
+                if similarity == 1.0:
+                    break
+        
+        if best_hash and best_score >= threshold:
+            logger.info(f"Cache hit ({best_score:.2f}) for: {question[:80]}")
+            return self.entries[best_hash]
+        return None
+    
+    def cache_answer(self, question: str, answer, source_documents: List[Dict] = None, embedding: List[float] = None):
+        """
+        Store an answer in the question cache.
+        
+        Args:
+            question: User's question
+            answer: Answer text, or list of response suggestions
+            source_documents: Source documents used for the answer
+            embedding: Optional query embedding, so reworded questions can reuse the answer
+        """
+        question_hash = self._hash_question(question)
+        words = self._words(question)
+        with self._lock:
+            entry = CacheEntry(
+                question=question,
+                answer=answer,
+                source_documents=source_documents or [],
+                timestamp=time.time(),
+                tokens=words,
+            )
+            # Re-inserted at the end, so the dict stays ordered oldest first
+            self._remove(question_hash)
+            self.entries[question_hash] = entry
+            self._index_entry(question_hash, entry)
+            if embedding is not None:
+                self.semantic.put(embedding, entry, key=question_hash)
+            
+            evicted = []
+            while len(self.entries) > self.max_entries:
+                evicted.append(next(iter(self.entries)))
+                self._remove(evicted[-1])
+        
+        # Single-row upsert, outside the lock so lookups aren't blocked on disk
+        try:
+            self.db.put_cached_answers([entry.to_row(question_hash)])
+            if evicted:
+                self.db.delete_cached_answers(evicted)
+        except Exception as e:
+            logger.error(f"Error saving cache: {e}")
+    
+    def clear(self):
+        """Drop every cached answer, e.g. after the document set changed."""
+        with self._lock:
+            self.entries = {}
+            self._vocabulary = {}
+            self._token_index = {}
+            self.semantic.clear()
+        try:
+            self.db.clear_cached_answers()
+        except Exception as e:
+            logger.error(f"Error clearing cache: {e}")
+
 class ConversationManager:
     """Manages conversation history, caching, and threading."""
     
-    def __init__(self, cache_dir: str = "./cache", db: object=None):
+    def __init__(self, cache_dir: str = "./cache", db: object=None, question_cache: "QuestionCache" = None):
         """Initialize conversation manager."""
         self.cache_dir = cache_dir
         self.conversations_file = os.path.join(cache_dir, "conversations.json")
-        self.cache_file = os.path.join(cache_dir, "question_cache.json")
         self.db = db
         self.user_id = None
+        # The user's conversation rows, and the same rows by id; refreshed only when threads are created or deleted
+        self.conversations: List[Dict] = []
+        self._by_id: Dict[str, Dict] = {}
+        # Formatted thread context per conversation; dropped whenever the thread changes
+        self._context_cache: Dict[str, str] = {}
                 
         # Ensure cache directory exists
         os.makedirs(cache_dir, exist_ok=True)
+        
+        # Answer cache, normally shared by all sessions of the process
+        self.question_cache = question_cache if question_cache is not None else QuestionCache(db if db is not None else SQLiteManager(), cache_dir)
     
     def _load_conversations(self) -> Dict:
         """Load conversation history from file."""
         if os.path.exists(self.conversations_file):
             try:
-                with open(self.conversations_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except Exception:
-                return {}
-        return {}
-    
-    def _load_cache(self) -> Dict:
-        """Load question cache from file."""
-        if os.path.exists(self.cache_file):
-            try:
-                with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                return _load_file(self.conversations_file)
             except Exception:
                 return {}
         return {}
@@ -49,32 +386,57 @@ class ConversationManager:
     def _save_conversations(self):
         """Save conversation history to file."""
         try:
-            with open(self.conversations_file, 'w', encoding='utf-8') as f:
-                json.dump(self.conversations, f, indent=2, ensure_ascii=False)
+            # Serialized in one call, so the file gets a single write
+            data = _dumps(self.conversations)
+            with open(self.conversations_file, 'wb') as f:
+                f.write(data)
         except Exception as e:
             print(f"Error saving conversations: {e}")
     
-    def _save_cache(self):
-        """Save question cache to file."""
-        try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(self.question_cache, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"Error saving cache: {e}")
+    def find_similar_question(self, question: str, threshold: float = 0.9, embedding: List[float] = None, conversation_context: str = "") -> Optional[CacheEntry]:
+        """
+        Find a cached answer for the same or a similar question (see QuestionCache).
+        
+        The cache is shared by every user, so it only holds answers generated
+        without thread history; a turn with conversation context never hits.
+        """
+        if conversation_context:
+            return None
+        return self.question_cache.find_similar_question(question, threshold, embedding)
     
-    def _hash_question(self, question: str) -> str:
-        """Create a hash for a question (normalized)."""
-        # Normalize question: lowercase, remove extra spaces
-        normalized = " ".join(question.lower().split())
-        return hashlib.md5(normalized.encode()).hexdigest()
+    def cache_answer(self, question: str, answer, source_documents: List[Dict] = None, embedding: List[float] = None, conversation_context: str = ""):
+        """
+        Store an answer in the question cache (see QuestionCache).
+        
+        Answers generated with conversation context are not stored, since they
+        may draw on one user's thread and the cache is shared by every user.
+        """
+        if conversation_context:
+            return
+        self.question_cache.cache_answer(question, answer, source_documents, embedding)
     
     def set_user(self, user_id):
         self.user_id = user_id
-        self.conversations = self.db.get_all_conversations_of_user(self.user_id)
+        self._context_cache.clear()
+        self.invalidate_cache()
         
     def disconnect_user(self):
         self.user_id = None
-        self.conversations = None
+        self._context_cache.clear()
+        self.conversations = []
+        self._by_id = {}
+    
+    def invalidate_cache(self):
+        """Reload the user's conversation list, e.g. after threads were changed outside this manager."""
+        self.conversations = self.db.get_all_conversations_of_user(self.user_id)
+        self._by_id = {conv["id"]: conv for conv in self.conversations}
+    
+    def _has_conversation(self, conversation_id: str) -> bool:
+        """Whether the user owns the thread; the list is reloaded once on a miss in case another session created it."""
+        if conversation_id in self._by_id:
+            return True
+        self.invalidate_cache()
+        return conversation_id in self._by_id
     
     #SQLite
     def create_conversation_thread(self, conversation_id: str = None) -> str:
@@ -91,19 +453,19 @@ class ConversationManager:
         #     }
         #     self._save_conversations()
             
-        if self.user_id:
-            if not any(conv["id"] == conversation_id for conv in self.conversations):
-                self.db.create_conversation(conversation_id, "", self.user_id)
-
-        self.conversations = self.db.get_all_conversations_of_user(self.user_id)                
+        if self.user_id and conversation_id not in self._by_id:
+            self.db.create_conversation(conversation_id, "", self.user_id)
+            self.invalidate_cache()
         return conversation_id
     
     #SQLite
     def add_message(self, conversation_id: str, sender: str, message: str, sources: List[Dict] = None, metadata: Dict = None, message_id: str=None):
         """Add a message to a conversation thread."""
-        if not any(conv["id"] == conversation_id for conv in self.conversations):
+        if conversation_id not in self._by_id:
             self.create_conversation_thread(conversation_id)
         
+        self._context_cache.pop(conversation_id, None)
+        
         # Store message
         try:
             position = self.db.add_message(conversation_id, sender, message)
@@ -118,8 +480,40 @@ class ConversationManager:
                 self.db.update_title(conversation_id, message[:100])
                 logger.info("Title updated!")# First 100 chars as topic
         
-        # Refresh cache
-        self.conversations = self.db.get_all_conversations_of_user(self.user_id)
+        return position
+    
+    #SQLite
+    def add_messages(self, conversation_id: str, messages: List[Tuple[str, str]]):
+        """
+        Add several messages to a conversation thread in a single database write.
+        
+        Args:
+            conversation_id: Conversation thread ID
+            messages: (sender, message) pairs in order
+            
+        Returns:
+            Position of the last stored message, or None if the write failed
+        """
+        if conversation_id not in self._by_id:
+            self.create_conversation_thread(conversation_id)
+        
+        self._context_cache.pop(conversation_id, None)
+        
+        position = None
+        try:
+            position = self.db.add_messages(conversation_id, messages)
+            logger.info(f"{len(messages)} messages added!")
+        except Exception as e:
+            logger.error(f"Failed to add messages: {e}")
+        
+        # Use the first user question as the topic
+        first_user_message = next((message for sender, message in messages if sender == "user"), None)
+        if first_user_message:
+            convo = self.db.get_conversation_of_user(conversation_id, self.user_id)
+            if convo and not convo.get("title"):
+                self.db.update_title(conversation_id, first_user_message[:100])
+                logger.info("Title updated!")
+        
         return position
     
     #SQLite
@@ -128,13 +522,7 @@ class ConversationManager:
         # if thread_id not in self.conversations:
         #    return []
         
-        conversations = self.db.get_all_conversations_of_user(self.user_id)
-        self.conversations = conversations
-        
-        valid_conversation_ids = {
-            conversation.get("id") for conversation in conversations if conversation.get("id")
-        }
-        if conversation_id not in valid_conversation_ids:
+        if not self._has_conversation(conversation_id):
             return []
         
         messages = self.db.get_all_messages_from_conversation(conversation_id)
@@ -145,6 +533,10 @@ class ConversationManager:
     #SQLite
     def get_thread_context(self, conversation_id: str) -> str:
         """Get formatted context from thread history for prompt."""
+        cached = self._context_cache.get(conversation_id)
+        if cached is not None:
+            return cached
+        
         history = self.get_conversation_history(conversation_id)
         
         if not history:
@@ -155,7 +547,9 @@ class ConversationManager:
             role = "User" if msg["sender"] == "user" else "Assistant"
             context_parts.append(f"{role}: {msg['message']}")
         
-        return "\n".join(context_parts)
+        context = "\n".join(context_parts)
+        self._context_cache[conversation_id] = context
+        return context
     
     #SQLite
     def get_all_conversations(self, user_id: str) -> List[Dict]:
@@ -163,27 +557,24 @@ class ConversationManager:
         Get all conversation threads with metadata.
         Each thread includes: id, title/topic, created_at, message_count.
         """        
-        threads = []
-        for thread_data in self.db.get_all_conversations_of_user(user_id):
-            topic = thread_data.get("title")
-            conversation_id = thread_data.get("id")
-            if not topic:
-                topic = "Untitled Conversation"
-                
-            threads.append({
-                "thread_id": conversation_id,
-                "topic": topic,
+        # One query returns the threads already sorted, with their message counts
+        return [
+            {
+                "thread_id": thread_data.get("id"),
+                "topic": thread_data.get("title") or "Untitled Conversation",
                 "created_at": thread_data.get("created_at"),
-                "message_count": self.db.get_count_message_of_conversation(conversation_id)
-            })
-        return sorted(threads, key=lambda x: x.get("created_at", ""), reverse=True)
+                "message_count": thread_data.get("message_count", 0)
+            }
+            for thread_data in self.db.get_conversation_summaries_of_user(user_id)
+        ]
     
     #SQLite
     def delete_conversation(self, conversation_id: str) -> None:
         """Delete a conversation thread."""
-        if any(conv["conversation_id"] == conversation_id for conv in self.conversations):
-            self.db.delete_row("conversations", "conversation_id = ?", (conversation_id,))
-            self.conversations = self.db.get_all_conversations_of_user()
+        self._context_cache.pop(conversation_id, None)
+        if self._by_id.pop(conversation_id, None) is not None:
+            self.db.delete_row("conversations", "id = ?", (conversation_id,))
+            self.conversations = [conv for conv in self.conversations if conv["id"] != conversation_id]
     
     # def delete_thread(self, thread_id: str):
     #     """Delete a conversation thread."""
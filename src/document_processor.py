@@ -2,18 +2,89 @@
 Document processing module for extracting and chunking PDF documents.
 """
 import os
+import threading
 import pdfplumber
-from typing import List, Dict, Optional
+try:
+    import pypdfium2 as pdfium
+    PDFIUM_AVAILABLE = True
+except ImportError:
+    PDFIUM_AVAILABLE = False
+from typing import ClassVar, Iterator, List, Dict, Optional, Tuple
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 import src.config as config
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import multiprocessing
 
+# Pages handed to a worker process at a time
+PAGES_PER_TASK = 8
+
+# PDFium is not thread-safe, so in-process calls are serialized
+_PDFIUM_LOCK = threading.Lock()
+
+
+def _count_pages(file_path: str) -> int:
+    """Number of pages in a PDF."""
+    if PDFIUM_AVAILABLE:
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def _extract_page_range(file_path: str, start: int, stop: int) -> List[Dict]:
+    """
+    Extract text from pages [start, stop) of a PDF.
+    
+    Uses PDFium (C++) when pypdfium2 is installed, pdfplumber otherwise.
+    Module-level so it can run in a worker process; each call opens its own handle.
+    """
+    page_data = []
+    if PDFIUM_AVAILABLE:
+        with _PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                for page_num in range(start, stop):
+                    page = pdf[page_num]
+                    textpage = page.get_textpage()
+                    # PDFium separates lines with CRLF
+                    text = textpage.get_text_range().replace("\r\n", "\n")
+                    textpage.close()
+                    page.close()
+                    if text and text.strip():
+                        page_data.append({
+                            "page": page_num + 1,
+                            "text": text.strip()
+                        })
+            finally:
+                pdf.close()
+        return page_data
+    
+    with pdfplumber.open(file_path) as pdf:
+        for page_num in range(start, stop):
+            page = pdf.pages[page_num]
+            text = page.extract_text()
+            # Drop the page's cached layout objects so memory stays at one page
+            page.close()
+            if text:
+                page_data.append({
+                    "page": page_num + 1,
+                    "text": text.strip()
+                })
+    return page_data
+
 
 class DocumentProcessor:
     """Process PDF documents and create chunks for RAG."""
     
+    # Splitters are stateless, so one instance per (chunk_size, chunk_overlap) is shared
+    _SPLITTER_CACHE: ClassVar[Dict[Tuple[int, int], RecursiveCharacterTextSplitter]] = {}
+    _SPLITTER_LOCK: ClassVar[threading.Lock] = threading.Lock()
+    
     def __init__(self, chunk_size: int = None, chunk_overlap: int = None):
         """
         Initialize the document processor.
@@ -25,46 +96,56 @@ class DocumentProcessor:
         self.chunk_size = chunk_size or config.CHUNK_SIZE
         self.chunk_overlap = chunk_overlap or config.CHUNK_OVERLAP
         
-        # Initialize text splitter
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            length_function=len,
-        )
+        self.text_splitter = self._get_splitter(self.chunk_size, self.chunk_overlap)
     
-    def extract_text_from_pdf(self, file_path: str) -> Dict[str, any]:
+    @classmethod
+    def _get_splitter(cls, chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+        """Return the shared text splitter for the given settings, creating it once."""
+        key = (chunk_size, chunk_overlap)
+        with cls._SPLITTER_LOCK:
+            splitter = cls._SPLITTER_CACHE.get(key)
+            if splitter is None:
+                splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=chunk_size,
+                    chunk_overlap=chunk_overlap,
+                    length_function=len,
+                )
+                cls._SPLITTER_CACHE[key] = splitter
+            return splitter
+    
+    def extract_pages_from_pdf(self, file_path: str, executor: Optional[Executor] = None) -> Dict[str, any]:
         """
-        Extract text from a PDF file.
+        Extract per-page text from a PDF file.
         
         Args:
             file_path: Path to the PDF file
+            executor: Optional process pool; the PDF is split into page ranges
+                extracted in parallel
             
         Returns:
-            Dictionary with text content and metadata
+            Dictionary with metadata and page_data ({page, text} per non-empty page)
         """
         try:
-            text_content = []
             metadata = {
                 "source": os.path.basename(file_path),
                 "file_path": file_path,
                 "total_pages": 0,
             }
             
-            with pdfplumber.open(file_path) as pdf:
-                metadata["total_pages"] = len(pdf.pages)
-                
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    text = page.extract_text()
-                    if text:
-                        text_content.append({
-                            "page": page_num,
-                            "text": text.strip()
-                        })
+            total_pages = _count_pages(file_path)
+            metadata["total_pages"] = total_pages
             
-            full_text = "\n\n".join([item["text"] for item in text_content])
+            if executor:
+                # Page parsing is CPU-bound, so page ranges run in worker processes
+                futures = [
+                    executor.submit(_extract_page_range, file_path, start, min(start + PAGES_PER_TASK, total_pages))
+                    for start in range(0, total_pages, PAGES_PER_TASK)
+                ]
+                text_content = [item for future in futures for item in future.result()]
+            else:
+                text_content = _extract_page_range(file_path, 0, total_pages)
             
             return {
-                "text": full_text,
                 "metadata": metadata,
                 "page_data": text_content
             }
@@ -72,13 +153,29 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"Error extracting text from PDF: {str(e)}")
     
-    def create_chunks(self, text: str, metadata: Dict = None) -> List[Document]:
+    def extract_text_from_pdf(self, file_path: str, executor: Optional[Executor] = None) -> Dict[str, any]:
+        """
+        Extract text from a PDF file.
+        
+        Args:
+            file_path: Path to the PDF file
+            executor: Optional process pool used for page extraction
+            
+        Returns:
+            Dictionary with text content and metadata
+        """
+        extraction_result = self.extract_pages_from_pdf(file_path, executor)
+        extraction_result["text"] = "\n\n".join([item["text"] for item in extraction_result["page_data"]])
+        return extraction_result
+    
+    def create_chunks(self, text: str, metadata: Dict = None, start_id: int = 0) -> List[Document]:
         """
         Create document chunks from text.
         
         Args:
             text: Full text content
             metadata: Document metadata
+            start_id: chunk_id of the first chunk
             
         Returns:
             List of Document objects with chunks
@@ -86,68 +183,71 @@ class DocumentProcessor:
         try:
             # Use recursive text splitter for chunking
             text_chunks = self.text_splitter.split_text(text)
-            documents = []
             
-            for i, chunk in enumerate(text_chunks):
-                chunk_metadata = {
-                    **(metadata or {}),
-                    "chunk_id": i,
-                    "chunk_size": len(chunk)
-                }
-                documents.append(Document(
+            # Each chunk gets one copy of the shared fields plus its own two keys
+            base_metadata = metadata or {}
+            return [
+                Document(
                     page_content=chunk,
-                    metadata=chunk_metadata
-                ))
-            
-            return documents
+                    metadata={**base_metadata, "chunk_id": chunk_id, "chunk_size": len(chunk)}
+                )
+                for chunk_id, chunk in enumerate(text_chunks, start_id)
+            ]
             
         except Exception as e:
             raise Exception(f"Error creating chunks: {str(e)}")
     
-    def process_pdf(self, file_path: str) -> List[Document]:
+    def process_pdf(self, file_path: str, executor: Optional[Executor] = None) -> List[Document]:
         """
         Complete PDF processing pipeline: extract and chunk.
         
         Args:
             file_path: Path to the PDF file
+            executor: Optional process pool used for page extraction
             
         Returns:
             List of Document chunks
         """
         # Extract text
-        extraction_result = self.extract_text_from_pdf(file_path)
+        extraction_result = self.extract_pages_from_pdf(file_path, executor)
+        metadata = extraction_result["metadata"]
         
-        # Create chunks
-        documents = self.create_chunks(
-            extraction_result["text"],
-            extraction_result["metadata"]
-        )
+        # Chunk page by page, so no whole-document string is built and every
+        # chunk records the page it came from
+        documents = []
+        for item in extraction_result["page_data"]:
+            metadata["page"] = item["page"]
+            documents.extend(self.create_chunks(item["text"], metadata, start_id=len(documents)))
         
         return documents
     
-    def process_multiple_pdfs(self, file_paths: List[str]) -> List[Document]:
+    def process_multiple_pdfs(self, file_paths: List[str]) -> Iterator[Document]:
         """
         Process multiple PDF files with parallel processing for faster execution.
         
+        Chunks are yielded file by file as each one finishes, so the caller can
+        start embedding while the remaining files are still being parsed.
+        
         Args:
             file_paths: List of PDF file paths
             
-        Returns:
-            Combined list of all document chunks
+        Yields:
+            Document chunks of all files
         """
-        all_documents = []
-        
-        # Use parallel processing if enabled and multiple files
-        if config.PARALLEL_PROCESSING and len(file_paths) > 1:
+        # Use parallel processing if enabled
+        if config.PARALLEL_PROCESSING:
             # Determine number of workers
-            max_workers = config.MAX_WORKERS if config.MAX_WORKERS > 0 else min(len(file_paths), multiprocessing.cpu_count())
+            max_workers = config.MAX_WORKERS if config.MAX_WORKERS > 0 else multiprocessing.cpu_count()
             
-            print(f"Processing {len(file_paths)} PDF files in parallel using {max_workers} workers...")
+            print(f"Processing {len(file_paths)} PDF files in parallel using {max_workers} worker processes...")
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Threads only coordinate files and chunk the results; page parsing is
+            # CPU-bound pure Python, so it runs in the process pool
+            with ProcessPoolExecutor(max_workers=max_workers) as process_pool, \
+                    ThreadPoolExecutor(max_workers=max(1, min(len(file_paths), max_workers))) as executor:
                 # Submit all tasks
                 future_to_file = {
-                    executor.submit(self.process_pdf, file_path): file_path 
+                    executor.submit(self.process_pdf, file_path, process_pool): file_path 
                     for file_path in file_paths
                 }
                 
@@ -156,21 +256,19 @@ class DocumentProcessor:
                     file_path = future_to_file[future]
                     try:
                         documents = future.result()
-                        all_documents.extend(documents)
                         print(f"✓ Processed: {os.path.basename(file_path)} ({len(documents)} chunks)")
                     except Exception as e:
                         print(f"✗ Error processing {file_path}: {str(e)}")
                         continue
+                    yield from documents
         else:
-            # Sequential processing (fallback or single file)
+            # Sequential processing (fallback)
             for file_path in file_paths:
                 try:
                     documents = self.process_pdf(file_path)
-                    all_documents.extend(documents)
                     print(f"✓ Processed: {os.path.basename(file_path)} ({len(documents)} chunks)")
                 except Exception as e:
                     print(f"✗ Error processing {file_path}: {str(e)}")
                     continue
-        
-        return all_documents
+                yield from documents
 
@@ -3,10 +3,15 @@ Image processing module for extracting text from images (OCR).
 Handles livechat inquiries with client names and questions.
 """
 import re
+import hashlib
+from collections import OrderedDict
 from typing import Dict, Optional, Tuple, List
 from PIL import Image
 import io
+import threading
+from functools import lru_cache
 import numpy as np
+import src.config as config
 
 try:
     import easyocr
@@ -21,94 +26,189 @@ except ImportError:
     TESSERACT_AVAILABLE = False
 
 
+# Image formats accepted by the chat input; passing them to Image.open skips probing every Pillow plugin
+IMAGE_FORMATS = ("PNG", "JPEG", "GIF", "BMP", "WEBP")
+
+# Number of OCR results kept per processor, keyed by image digest
+OCR_CACHE_SIZE = 64
+
+# Question splitting patterns (1., 2., 3. or 1) 2) 3) or 1- 2- 3-; -, *, •; runs of ?)
+NUMBERED_QUESTION_RE = re.compile(r'(?:^|\n)\s*(?:\d+[\.\)\-]\s*)([^\n\d]+?)(?=\n\s*(?:\d+[\.\)\-]|$))', re.MULTILINE | re.IGNORECASE)
+BULLETED_QUESTION_RE = re.compile(r'(?:^|\n)\s*[-*•]\s*([^\n]+?)(?=\n\s*[-*•]|$)', re.MULTILINE)
+QUESTION_MARKS_RE = re.compile(r'\?+')
+DIGITS = frozenset("0123456789")
+BULLETS = frozenset("-*•")
+QUESTION_WORDS = ('what', 'how', 'when', 'where', 'why', 'who', 'can', 'do', 'does', 'is', 'are', 'will', 'would')
+
+# Client name patterns, tried in order
+NAME_PATTERNS = tuple(re.compile(pattern, re.IGNORECASE) for pattern in (
+    r"(?:Hi|Hello|Hey|Dear)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "Hi John" or "Hello John Smith"
+    r"(?:Name|Client|From):\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "Name: John Smith"
+    r"(?:My name is|I'm|I am)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "My name is John"
+    r"^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+said",  # "John Smith said"
+))
+GREETING_RE = re.compile(r'^(Hi|Hello|Hey|Dear|Good morning|Good afternoon|Good evening)[,.\s]*', re.IGNORECASE)
+INTRODUCTION_RE = re.compile(r'^(My name is|I\'m|I am)\s+[A-Za-z\s]+[,.\s]*', re.IGNORECASE)
+
+
+@lru_cache(maxsize=None)
+def _probe_gpu() -> Tuple[bool, bool, Optional[str], int]:
+    """
+    Probe PyTorch/CUDA once per process.
+    
+    Returns:
+        (torch installed, CUDA available, device name, device count)
+    """
+    try:
+        import torch
+    except ImportError:
+        return False, False, None, 0
+    try:
+        if torch.cuda.is_available():
+            return True, True, torch.cuda.get_device_name(0), torch.cuda.device_count()
+    except Exception as e:
+        print(f"⚠️ GPU check failed: {e}, trying CPU...")
+    return True, False, None, 0
+
+
+def open_image(source) -> Image.Image:
+    """
+    Open and fully decode an image restricted to the supported formats.
+    
+    Args:
+        source: File path or binary file-like object
+        
+    Returns:
+        Loaded PIL Image (no longer tied to the source buffer)
+    """
+    image = Image.open(source, formats=IMAGE_FORMATS)
+    image.load()
+    return image
+
+
 class ImageProcessor:
     """Process images to extract text and parse client information."""
     
     def __init__(self):
-        """Initialize OCR readers with GPU prioritized, CPU as fallback only."""
-        self.easyocr_reader = None
-        self.use_easyocr = False
+        """
+        Check that an OCR engine is installed.
+        
+        The EasyOCR reader (torch + model weights) is built on first use, see easyocr_reader.
+        """
+        if not EASYOCR_AVAILABLE and not TESSERACT_AVAILABLE:
+            raise ImportError("Neither EasyOCR nor pytesseract is available. Please install one: pip install easyocr or pip install pytesseract")
+        
+        self._reader = None
+        self._init_done = False
+        self._init_lock = threading.Lock()
         self.use_gpu = False
         
+        # image digest -> extracted text, least recently used first
+        self._ocr_cache: "OrderedDict[bytes, str]" = OrderedDict()
+        self._ocr_cache_lock = threading.Lock()
+    
+    @property
+    def easyocr_reader(self):
+        """EasyOCR reader, initialized on first access (None if EasyOCR is unavailable or failed)."""
+        if not self._init_done:
+            with self._init_lock:
+                if not self._init_done:
+                    self._init_reader()
+                    self._init_done = True
+        return self._reader
+    
+    @property
+    def use_easyocr(self) -> bool:
+        """Whether OCR goes through EasyOCR (initializes the reader)."""
+        return self.easyocr_reader is not None
+    
+    def _init_reader(self):
+        """Initialize the EasyOCR reader with GPU prioritized, CPU as fallback only."""
         if EASYOCR_AVAILABLE:
             # ALWAYS try GPU first, only use CPU as fallback
-            gpu_attempted = False
             gpu_success = False
+            torch_available, gpu_available, device_name, device_count = _probe_gpu()
             
             # Priority 1: Try GPU initialization first
-            try:
-                import torch
-                
-                # Enhanced GPU detection with diagnostics
-                gpu_available = torch.cuda.is_available()
-                
-                if gpu_available:
-                    gpu_attempted = True
-                    try:
-                        # Initialize EasyOCR with GPU for maximum performance
-                        self.easyocr_reader = easyocr.Reader(['en'], gpu=True)
-                        self.use_gpu = True
-                        gpu_success = True
-                        device_name = torch.cuda.get_device_name(0)
-                        device_count = torch.cuda.device_count()
-                        print(f"✅ EasyOCR initialized with GPU: {device_name} (Device {device_count} available)")
-                    except Exception as gpu_init_error:
-                        print(f"⚠️ EasyOCR GPU initialization failed: {gpu_init_error}")
-                        print("🔄 Falling back to CPU...")
-                        gpu_success = False
-                else:
-                    # Enhanced diagnostics for GPU detection failure
-                    print("ℹ️ GPU not available via PyTorch CUDA detection")
-                    print("   This usually means:")
-                    print("   1. PyTorch was installed without CUDA support (CPU-only version)")
-                    print("   2. CUDA toolkit is not installed or not in PATH")
-                    print("   3. CUDA version mismatch between PyTorch and system")
-                    print("   4. NVIDIA drivers need to be updated")
-                    print("   💡 To fix: Install PyTorch with CUDA support: pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118")
-                    print("   Falling back to CPU...")
-            except ImportError:
+            if gpu_available:
+                try:
+                    # Initialize EasyOCR with GPU for maximum performance
+                    self._reader = easyocr.Reader(['en'], gpu=True)
+                    self.use_gpu = True
+                    gpu_success = True
+                    print(f"✅ EasyOCR initialized with GPU: {device_name} (Device {device_count} available)")
+                except Exception as gpu_init_error:
+                    print(f"⚠️ EasyOCR GPU initialization failed: {gpu_init_error}")
+                    print("🔄 Falling back to CPU...")
+            elif torch_available:
+                # Enhanced diagnostics for GPU detection failure
+                print("ℹ️ GPU not available via PyTorch CUDA detection")
+                print("   This usually means:")
+                print("   1. PyTorch was installed without CUDA support (CPU-only version)")
+                print("   2. CUDA toolkit is not installed or not in PATH")
+                print("   3. CUDA version mismatch between PyTorch and system")
+                print("   4. NVIDIA drivers need to be updated")
+                print("   💡 To fix: Install PyTorch with CUDA support: pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu118")
+                print("   Falling back to CPU...")
+            else:
                 print("⚠️ PyTorch not available - cannot check for GPU")
                 print("   💡 Install PyTorch: pip install torch")
-                gpu_success = False
-            except Exception as e:
-                if gpu_attempted:
-                    print(f"⚠️ EasyOCR GPU initialization failed: {e}")
-                    print("🔄 Falling back to CPU...")
-                else:
-                    print(f"⚠️ GPU check failed: {e}, trying CPU...")
-                gpu_success = False
             
             # Priority 2: Only use CPU if GPU initialization failed or GPU not available
             if not gpu_success:
                 try:
-                    self.easyocr_reader = easyocr.Reader(['en'], gpu=False)
-                    self.use_easyocr = True
+                    # int8 dynamic quantization of the recognizer's LSTM/Linear layers
+                    self._reader = easyocr.Reader(['en'], gpu=False, quantize=True)
                     self.use_gpu = False
                     print("✅ EasyOCR initialized with CPU (GPU unavailable or failed)")
                 except Exception as e2:
                     print(f"❌ EasyOCR CPU initialization also failed: {e2}")
-                    self.use_easyocr = False
-            else:
-                self.use_easyocr = True
+    
+    def _cached_ocr(self, key: bytes, ocr_fn, source) -> str:
+        """Return the cached text for an image digest, running ocr_fn(source) on a miss."""
+        with self._ocr_cache_lock:
+            text = self._ocr_cache.get(key)
+            if text is not None:
+                self._ocr_cache.move_to_end(key)
+                return text
         
-        if not self.use_easyocr and not TESSERACT_AVAILABLE:
-            raise ImportError("Neither EasyOCR nor pytesseract is available. Please install one: pip install easyocr or pip install pytesseract")
+        # OCR runs outside the lock so different images are processed concurrently
+        text = ocr_fn(source)
+        with self._ocr_cache_lock:
+            self._ocr_cache[key] = text
+            if len(self._ocr_cache) > OCR_CACHE_SIZE:
+                self._ocr_cache.popitem(last=False)
+        return text
     
     def extract_text_from_image(self, image: Image.Image) -> str:
         """
         Extract text from an image using OCR.
         
+        Results are cached by a digest of the pixel data, so the same screenshot
+        is only recognized once.
+        
         Args:
             image: PIL Image object
             
         Returns:
             Extracted text as string
         """
+        # Mode and size are part of the key: equal pixel bytes can form different images
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f"{image.mode}{image.size}".encode())
+        return self._cached_ocr(digest.digest(), self._ocr_image, image)
+    
+    def _ocr_image(self, image: Image.Image) -> str:
+        """Run OCR on a PIL image (uncached)."""
         try:
-            if self.use_easyocr and self.easyocr_reader:
-                # EasyOCR processing - convert PIL Image to numpy array
-                image_array = np.array(image)
-                result = self.easyocr_reader.readtext(image_array)
+            if self.use_easyocr:
+                # EasyOCR reads grayscale, RGB and RGBA arrays; palette/CMYK/etc. are converted first
+                if image.mode not in ("L", "RGB", "RGBA"):
+                    image = image.convert("RGB")
+                # Read-only view of the pixel data: EasyOCR never writes to its input
+                image_array = np.asarray(image)
+                # canvas_size caps the detector input; text is still recognized from the full-size image
+                result = self.easyocr_reader.readtext(image_array, canvas_size=config.OCR_MAX_SIDE)
                 # Combine all detected text
                 text = " ".join([item[1] for item in result])
                 return text.strip()
@@ -121,6 +221,33 @@ class ImageProcessor:
         except Exception as e:
             raise Exception(f"Error extracting text from image: {str(e)}")
     
+    def extract_text_from_bytes(self, raw: bytes) -> str:
+        """
+        Extract text from encoded image bytes (PNG, JPEG, ...) using OCR.
+        
+        EasyOCR decodes the bytes itself, so no PIL decode/convert round-trip is needed.
+        PIL is only used when falling back to Tesseract. Results are cached by a
+        digest of the encoded bytes.
+        
+        Args:
+            raw: Encoded image file content
+            
+        Returns:
+            Extracted text as string
+        """
+        return self._cached_ocr(hashlib.blake2b(raw, digest_size=16).digest(), self._ocr_bytes, raw)
+    
+    def _ocr_bytes(self, raw: bytes) -> str:
+        """Run OCR on encoded image bytes (uncached)."""
+        if self.use_easyocr:
+            try:
+                result = self.easyocr_reader.readtext(raw, canvas_size=config.OCR_MAX_SIDE)
+                text = " ".join([item[1] for item in result])
+                return text.strip()
+            except Exception as e:
+                raise Exception(f"Error extracting text from image: {str(e)}")
+        return self._ocr_image(open_image(io.BytesIO(raw)))
+    
     def detect_multiple_questions(self, text: str) -> List[str]:
         """
         Detect and parse multiple questions from text.
@@ -134,39 +261,56 @@ class ImageProcessor:
         """
         questions = []
         
+        # Each pattern needs a trigger character (digit, bullet, '?' or newline);
+        # a single-line OCR snippet without any of them takes the fast path
+        has_digits = not DIGITS.isdisjoint(text)
+        has_bullets = not BULLETS.isdisjoint(text)
+        multiline = "\n" in text
+        if not (has_digits or has_bullets or multiline) and text.count('?') < 2:
+            return []
+        
         # Pattern 1: Numbered questions (1., 2., 3. or 1) 2) 3) or 1- 2- 3-)
-        numbered_pattern = r'(?:^|\n)\s*(?:\d+[\.\)\-]\s*)([^\n\d]+?)(?=\n\s*(?:\d+[\.\)\-]|$))'
-        numbered_matches = re.findall(numbered_pattern, text, re.MULTILINE | re.IGNORECASE)
-        if len(numbered_matches) >= 2:
-            questions = [q.strip() for q in numbered_matches if q.strip()]
-            return questions
+        if has_digits:
+            numbered_matches = NUMBERED_QUESTION_RE.findall(text)
+            if len(numbered_matches) >= 2:
+                questions = [q.strip() for q in numbered_matches if q.strip()]
+                return questions
         
         # Pattern 2: Bulleted questions (-, *, •, etc.)
-        bulleted_pattern = r'(?:^|\n)\s*[-*•]\s*([^\n]+?)(?=\n\s*[-*•]|$)'
-        bulleted_matches = re.findall(bulleted_pattern, text, re.MULTILINE)
-        if len(bulleted_matches) >= 2:
-            questions = [q.strip() for q in bulleted_matches if q.strip()]
-            return questions
+        if has_bullets:
+            bulleted_matches = BULLETED_QUESTION_RE.findall(text)
+            if len(bulleted_matches) >= 2:
+                questions = [q.strip() for q in bulleted_matches if q.strip()]
+                return questions
         
         # Pattern 3: Question marks as separators (split by ?)
         question_marks = text.count('?')
         if question_marks >= 2:
             # Split by question marks and keep parts that look like questions
-            parts = re.split(r'\?+', text)
+            parts = QUESTION_MARKS_RE.split(text)
             questions = [p.strip() + '?' for p in parts if len(p.strip()) > 10]
             if len(questions) >= 2:
                 return questions
         
         # Pattern 4: Newline-separated questions (each line that ends with ?)
-        lines = text.split('\n')
+        if not multiline:
+            return []
         question_lines = []
-        for line in lines:
+        for line in text.splitlines():
             line = line.strip()
             # Skip empty lines, very short lines, or lines that look like headers
-            if len(line) > 15 and ('?' in line or line[0].isupper() or any(word in line.lower() for word in ['what', 'how', 'when', 'where', 'why', 'who', 'can', 'do', 'does', 'is', 'are', 'will', 'would'])):
-                # Skip if it looks like a title/header (all caps, very short)
-                if not (line.isupper() and len(line) < 50):
-                    question_lines.append(line)
+            if len(line) <= 15:
+                continue
+            # Skip if it looks like a title/header (all caps, very short)
+            if line.isupper() and len(line) < 50:
+                continue
+            if '?' in line or line[0].isupper():
+                question_lines.append(line)
+                continue
+            # Lowercased once per line, not once per question word
+            lowered = line.lower()
+            if any(word in lowered for word in QUESTION_WORDS):
+                question_lines.append(line)
         
         if len(question_lines) >= 2:
             return question_lines
@@ -189,24 +333,18 @@ class ImageProcessor:
         if not text:
             return {"client_name": None, "inquiry": None, "questions": []}
         
-        # Common patterns for client names
-        name_patterns = [
-            r"(?:Hi|Hello|Hey|Dear)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "Hi John" or "Hello John Smith"
-            r"(?:Name|Client|From):\s*([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "Name: John Smith"
-            r"(?:My name is|I'm|I am)\s+([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)",  # "My name is John"
-            r"^([A-Z][a-z]+(?:\s+[A-Z][a-z]+)*)\s+said",  # "John Smith said"
-        ]
-        
         client_name = None
         inquiry = text
         
         # Try to extract client name
-        for pattern in name_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                client_name = match.group(1).strip()
-                # Remove the name part from inquiry
-                inquiry = re.sub(pattern, "", text, flags=re.IGNORECASE).strip()
+        for pattern in NAME_PATTERNS:
+            # One pass per pattern: sub() removes the name parts from the inquiry
+            # and records the names it removed
+            names = []
+            stripped = pattern.sub(lambda match: names.append(match.group(1)) or "", text)
+            if names:
+                client_name = names[0].strip()
+                inquiry = stripped.strip()
                 break
         
         # If no name found, try to find first capitalized word sequence
@@ -229,8 +367,8 @@ class ImageProcessor:
         # Clean up inquiry - remove common greetings and filler (but keep questions)
         if inquiry:
             # Remove common greetings at the start
-            inquiry = re.sub(r'^(Hi|Hello|Hey|Dear|Good morning|Good afternoon|Good evening)[,.\s]*', '', inquiry, flags=re.IGNORECASE)
-            inquiry = re.sub(r'^(My name is|I\'m|I am)\s+[A-Za-z\s]+[,.\s]*', '', inquiry, flags=re.IGNORECASE)
+            inquiry = GREETING_RE.sub('', inquiry)
+            inquiry = INTRODUCTION_RE.sub('', inquiry)
             inquiry = inquiry.strip()
         
         # NEW: Detect multiple questions
@@ -265,9 +403,25 @@ class ImageProcessor:
         Returns:
             Dictionary with extracted_text, client_name, and inquiry
         """
+        return self._process(self.extract_text_from_image, image)
+    
+    def process_bytes(self, raw: bytes) -> Dict[str, any]:
+        """
+        Complete image processing for encoded image bytes.
+        
+        Args:
+            raw: Encoded image file content
+            
+        Returns:
+            Dictionary with extracted_text, client_name, and inquiry
+        """
+        return self._process(self.extract_text_from_bytes, raw)
+    
+    def _process(self, extract_fn, source) -> Dict[str, any]:
+        """Run text extraction followed by client inquiry parsing."""
         try:
             # Extract text
-            extracted_text = self.extract_text_from_image(image)
+            extracted_text = extract_fn(source)
             
             # Parse client information
             parsed_info = self.parse_client_inquiry(extracted_text)
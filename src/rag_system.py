@@ -2,7 +2,11 @@
 RAG system implementation using LangChain, Ollama, and DeepSeek R1 8B.
 """
 import os
-from typing import List, Optional, Dict
+import re
+import itertools
+from collections import deque
+from functools import lru_cache
+from typing import Any, List, Optional, Dict, Iterable, Iterator, Tuple
 from langchain_ollama import OllamaLLM, OllamaEmbeddings
 try:
     from langchain_chroma import Chroma
@@ -10,36 +14,81 @@ except ImportError:
     # Fallback to community version
     from langchain_community.vectorstores import Chroma
 from langchain_core.documents import Document
-from langchain_core.prompts import PromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
 import src.config as config
-from .document_processor import DocumentProcessor
 import multiprocessing
 from .utils.prompt_templates import PromptTemplates
 from src.vectorstore_manager import VectorstoreManager
 from langchain_nomic import NomicEmbeddings
 
 USE_OLLAMA=config.USE_OLLAMA
-
-if not USE_OLLAMA:
-    from langchain_google_genai import ChatGoogleGenerativeAI
 from src.utils.logger import AppLogger
 
 logger = AppLogger(name="conversation_manager")
 
+# Source names are shown with separators turned into spaces
+SOURCE_NAME_TABLE = str.maketrans("_-", "  ")
+
+@lru_cache(maxsize=1024)
+def _clean_source(source: str) -> str:
+    """Source file name without directories (either separator) or extension."""
+    return os.path.splitext(os.path.basename(source.replace("\\", "/")))[0]
+
+# Labelled suggestion start, e.g. "Response 2:" or "**Response 2:**"
+RESPONSE_LABEL_RE = re.compile(r"^[\s*#]*Response\s+\d+\b[*:.)\-]*\s*", re.IGNORECASE)
+# Bare numbered suggestion start, e.g. "2." or "**2:**"; the number must be followed by
+# whitespace or the line end, so times like "9:00" never match
+NUMBERED_MARKER_RE = re.compile(r"^[\s*#]*(\d+)[.:]\**(?=\s|$)\s*")
+
+class _PromptLenTracker:
+    """
+    Rolling sample of prompt sizes, to check CONTEXT_SIZE against the real workload.
+    
+    The context window is fixed when the model loads, and changing it means a
+    reload, so this only reports a better-fitting num_ctx instead of applying it.
+    """
+    
+    def __init__(self, window: int = 512, min_samples: int = 64):
+        self.lengths = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.recommended = None
+    
+    def record(self, prompt: str):
+        """Record a prompt and log when the recommended context size changes."""
+        # ~4 characters per token, plus room for the generated answer
+        self.lengths.append(len(prompt) // 4 + config.MAX_TOKENS)
+        if len(self.lengths) < self.min_samples:
+            return
+        ordered = sorted(self.lengths)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        recommended = 1 << (p95 - 1).bit_length()
+        if recommended != self.recommended:
+            self.recommended = recommended
+            if recommended < config.CONTEXT_SIZE:
+                logger.info(f"[RAG] 95% of prompts fit in {p95} tokens; CONTEXT_SIZE={recommended} would cover them (configured: {config.CONTEXT_SIZE})")
+            elif recommended > config.CONTEXT_SIZE:
+                logger.warning(f"[RAG] 95% of prompts need up to {p95} tokens, more than CONTEXT_SIZE={config.CONTEXT_SIZE}; long prompts are being truncated")
+
 class RAGSystem:
     """RAG system for querying documents using DeepSeek R1 8B."""
     
-    def __init__(self):
-        """Initialize the RAG system."""
+    def __init__(self, answer_cache=None):
+        """
+        Initialize the RAG system.
+        
+        Args:
+            answer_cache: Optional shared answer cache (e.g. QuestionCache), cleared whenever documents are processed
+        """
+        self.answer_cache = answer_cache
         self.llm = None
         self.embeddings = None
         self.vectorstore = None
         self.retriever = None
-        self.qa_chain = None
+        self.ready = False  # True once a vector store is loaded and queries can run
         self.prompt_templates = PromptTemplates()
-        self.document_processor = DocumentProcessor()
+        # Prompt templates never change, so build them once instead of per query
+        self._ctx_tmpl_str = self.prompt_templates.context_prompt_template()
+        self._suggestion_template = lru_cache(maxsize=8)(self._build_suggestion_template)
+        self._document_processor = None  # Created on first ingestion (see document_processor)
         self.vectorstore_manager = None
         
         # Initialize LLM and embeddings
@@ -48,6 +97,12 @@ class RAGSystem:
         
         # Initialize VectorstoreManager
         self.vectorstore_manager = VectorstoreManager(self.embeddings)
+        
+        # Recent query embeddings, so repeated questions skip the embedding call
+        self._embed_query_cached = lru_cache(maxsize=config.QUERY_EMBEDDING_CACHE_SIZE)(self._embed_query_uncached)
+        
+        # Observed prompt sizes, to report a context window that fits them
+        self._prompt_lengths = _PromptLenTracker()
     
     def _initialize_llm(self):
         """Initialize the Ollama LLM (DeepSeek R1 8B) with GPU prioritized, CPU as fallback only."""
@@ -61,6 +116,8 @@ class RAGSystem:
                     "base_url": config.OLLAMA_BASE_URL,
                     "temperature": config.TEMPERATURE,
                     "num_predict": config.MAX_TOKENS,
+                    # Keep the model resident so its cached prompt prefix survives between requests
+                    "keep_alive": int(config.OLLAMA_KEEP_ALIVE) if config.OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else config.OLLAMA_KEEP_ALIVE,
                 }
                 
                 # ALWAYS prioritize GPU - set GPU layers first
@@ -102,6 +159,7 @@ class RAGSystem:
             except Exception as e:
                 raise Exception(f"Failed to initialize LLM: {str(e)}")
         else:
+            from langchain_google_genai import ChatGoogleGenerativeAI
             self.llm = ChatGoogleGenerativeAI(
                 model=config.GEMINI_MODEL,
                 temperature=0,
@@ -109,6 +167,14 @@ class RAGSystem:
                 timeout=None
             )
     
+    @property
+    def document_processor(self):
+        """PDF processor, imported and created on first use since query-only sessions never ingest."""
+        if self._document_processor is None:
+            from .document_processor import DocumentProcessor
+            self._document_processor = DocumentProcessor()
+        return self._document_processor
+    
     def _initialize_embeddings(self):
         """Initialize Ollama embeddings with GPU prioritized, CPU as fallback only."""
         if USE_OLLAMA:
@@ -127,7 +193,7 @@ class RAGSystem:
                     print("⚠️ Embeddings GPU disabled, using CPU mode")
                 
                 embedding_model = getattr(config, "EMBEDDING_MODEL", "embedding-gecko-001")
-                self.embeddings = NomicEmbeddings(model=embedding_model)
+                self.embeddings = NomicEmbeddings(**self._nomic_params(embedding_model))
                 
                 # Log GPU/CPU configuration
                 if hasattr(config, 'NUM_GPU_LAYERS') and config.NUM_GPU_LAYERS != 0:
@@ -143,66 +209,102 @@ class RAGSystem:
                 # Fallback: Nomic embeddings
                 logger.info("Using nomic embeddings (Google-compatible fallback)")
                 embedding_model = getattr(config, "EMBEDDING_MODEL", "embedding-gecko-001")
-                self.embeddings = NomicEmbeddings(model=embedding_model)
+                self.embeddings = NomicEmbeddings(**self._nomic_params(embedding_model))
                 logger.info(f"Nomic embeddings initialized: {embedding_model}")
             except Exception as e:
                 raise Exception(f"Failed to initialize Nomic embeddings: {str(e)}")
         
-    def process_documents(self, file_paths: List[str]):
-        """Process documents and create vector store"""
+    def _nomic_params(self, embedding_model: str) -> Dict[str, Any]:
+        """
+        NomicEmbeddings arguments for the configured inference mode.
+        
+        Local mode runs a quantized build of the same model on this machine, so bulk
+        ingestion skips the API round trips while queries and documents still share
+        one vector space.
+        """
+        params = {"model": embedding_model, "inference_mode": config.EMBEDDING_INFERENCE_MODE}
+        if config.EMBEDDING_INFERENCE_MODE != "remote" and config.EMBEDDING_DEVICE:
+            params["device"] = config.EMBEDDING_DEVICE
+        return params
+    
+    def process_documents(self, file_paths: List[str], file_hashes: Optional[Dict[str, str]] = None):
+        """
+        Process documents and create vector store.
+        
+        Args:
+            file_paths: List of PDF file paths
+            file_hashes: Optional mapping of file path to content hash, stored in
+                chunk metadata so re-uploads of the same file can be skipped
+        """
+        # Chunks stream in file by file, so embedding overlaps with parsing
         documents = self.document_processor.process_multiple_pdfs(file_paths)
-        if not documents:
+        first = next(documents, None)
+        if first is None:
             raise ValueError("No documents were successfully processed")
+        documents = itertools.chain([first], documents)
+        
+        if file_hashes:
+            documents = self._tag_file_hashes(documents, file_hashes)
         
         # Build or update the vector store
         self.vectorstore_manager.create_vectorstore(documents, persist=True)
+        # Cached answers may not reflect the new documents
+        if self.answer_cache is not None:
+            self.answer_cache.clear()
         # Sync local handles
         self.vectorstore = self.vectorstore_manager.vectorstore
         self.retriever = self.vectorstore_manager.retriever
         # Create QA chain now that retriever is ready
-        self._create_qa_chain()
+        self._prepare_query_path()
     
-    def _create_qa_chain(self):
-        """Create the QA chain using LCEL (LangChain Expression Language)."""
-        # Business-friendly prompt - personalized, clear, no technical jargon with context awareness
-        prompt_template = self.prompt_templates.qa_prompt_template()
-
-        prompt = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
+    def _tag_file_hashes(self, documents: Iterable[Document], file_hashes: Dict[str, str]) -> Iterator[Document]:
+        """Set each chunk's file_hash metadata from its file path as the chunks stream through."""
+        for doc in documents:
+            file_hash = file_hashes.get(doc.metadata.get("file_path"))
+            if file_hash:
+                doc.metadata["file_hash"] = file_hash
+            yield doc
+    
+    def _prepare_query_path(self):
+        """
+        Prepare the QA path once a vector store is available.
         
+        query() and the suggestion methods retrieve and prompt the LLM directly,
+        so no LCEL chain is built; this sets up the shared helpers and marks the
+        system as ready.
+        """
         # Format documents function - limit context length and filter technical metadata
         def format_docs(docs):
             # Limit each chunk to 800 chars and join with separators
-            formatted = []
             max_chars = 800  # Limit per chunk for faster processing
-            for doc in docs:
-                content = doc.page_content[:max_chars]
-                # Remove any code-like patterns or technical references
-                # Keep only business-relevant content
-                formatted.append(content)
-            return "\n\n".join(formatted)
+            # Stable chunk order so the same retrieved set always yields the same prompt prefix,
+            # letting Ollama reuse its cached prefill instead of recomputing it
+            ordered = sorted(docs, key=lambda d: (str(d.metadata.get("source", "")), d.metadata.get("chunk_id", 0)))
+            return "\n\n".join(doc.page_content[:max_chars] for doc in ordered)
         
         # Store format_docs for use in query method
         self._format_docs = format_docs
         
-        # Create the chain using LCEL (for backward compatibility, though we override query method)
-        # Retrieve documents -> format -> prompt -> LLM -> parse
-        self.qa_chain = (
-            {
-                "context": self.retriever | format_docs,
-                "question": RunnablePassthrough(),
-            }
-            | prompt
-            | self.llm
-            | StrOutputParser()
-        )
+        self.ready = True
         
         # Store retriever separately for source documents
         self._retriever = self.retriever
     
-    def generate_response_suggestions(self, question: str, client_name: str = None, conversation_context: str = "", num_suggestions: int = 2) -> Dict[str, any]:
+    def embed_query(self, question: str) -> List[float]:
+        """Embed a question once so it can be reused across retrieval calls."""
+        return list(self._embed_query_cached(question))
+    
+    def _embed_query_uncached(self, question: str) -> Tuple[float, ...]:
+        """Call the embedding model; results are immutable so they can be shared from the cache."""
+        return tuple(self.embeddings.embed_query(question))
+    
+    def _retrieve(self, question: str, query_embedding: Optional[List[float]] = None) -> List[Document]:
+        """Retrieve source documents, searching by a precomputed embedding when given."""
+        if query_embedding is not None and self.vectorstore:
+            return self.vectorstore.similarity_search_by_vector(query_embedding, k=config.TOP_K)
+        return self._retriever.invoke(question)
+    
+    def generate_response_suggestions(self, question: str, client_name: str = None, conversation_context: str = "", num_suggestions: int = 2, query_embedding: Optional[List[float]] = None) -> Dict[str, any]:
         """
         Generate multiple response suggestions for a client inquiry.
         
@@ -211,134 +313,232 @@ class RAGSystem:
             client_name: Name of the client (for personalization)
             conversation_context: Previous conversation context
             num_suggestions: Number of response suggestions to generate (default: 2)
+            query_embedding: Precomputed embedding of the question (skips re-embedding)
             
         Returns:
             Dictionary with multiple answer suggestions and source documents
         """
-        if not self.qa_chain:
+        if not self.ready:
             raise ValueError("Vector store not initialized. Please process documents first.")
         
         try:
             logger.info(f"[RAG] Generating {num_suggestions} suggestions for: {question[:80]}")
-            # Retrieve source documents first
-            source_docs = self._retriever.invoke(question)
-            
-            # Format context
-            formatted_context = self._format_docs(source_docs)
-            
-            # Format conversation context
-            conv_context_text = f"Previous conversation:\n{conversation_context}\n" if conversation_context else ""
-            
-            # Build personalized prompt for multiple response suggestions
-            client_greeting = f"Dear {client_name}," if client_name else "Hello,"
-            
-            suggestions_prompt_template = self.prompt_templates.suggestion_prompt_template(num_suggestions, client_name, conv_context_text, client_greeting)
-            
-            # Build the full prompt
-            full_prompt = suggestions_prompt_template.format(
-                context=formatted_context,
-                question=question
-            )
+            full_prompt, filtered_sources = self._build_suggestions_prompt(question, client_name, conversation_context, num_suggestions, query_embedding)
             
             # Get answer from LLM
             try:
                 answer_text = self.llm.invoke(full_prompt)
-                
-                # Validate response
-                if not answer_text or len(str(answer_text).strip()) < 10:
-                    raise Exception("LLM returned empty or very short response")
-                
             except Exception as e:
                 raise Exception(f"Error getting response from LLM: {str(e)}")
             
-            # Parse multiple responses
-            try:
-                suggestions = self._parse_response_suggestions(answer_text, num_suggestions)
-                
-                # If parsing failed, try to extract at least one response
-                if not suggestions or len(suggestions) == 0:
-                    # Try to extract any response from the raw text
-                    answer_str = str(answer_text).strip()
-                    if len(answer_str) > 20:
-                        # Use the full answer as a single suggestion
-                        suggestions = [answer_str]
-                    else:
-                        raise Exception("Could not parse any valid responses from LLM output")
-            except Exception as e:
-                raise Exception(f"Error parsing response suggestions: {str(e)}")
-            
-            # Filter source documents
-            filtered_sources = []
-            for doc in source_docs:
-                source_name = doc.metadata.get("source", "Document")
-                if "/" in source_name or "\\" in source_name:
-                    source_name = source_name.split("/")[-1].split("\\")[-1]
-                if "." in source_name:
-                    source_name = source_name.rsplit(".", 1)[0]
-                
-                content = doc.page_content[:400] + "..." if len(doc.page_content) > 400 else doc.page_content
-                
-                clean_metadata = {}
-                if "total_pages" in doc.metadata:
-                    clean_metadata["pages"] = doc.metadata.get("total_pages", "")
-                
-                filtered_sources.append({
-                    "content": content,
-                    "source": source_name,
-                    "metadata": clean_metadata
-                })
+            return self.finalize_response_suggestions(answer_text, filtered_sources, question, client_name, num_suggestions)
+        except Exception as e:
+            raise Exception(f"Error generating response suggestions: {str(e)}")
+    
+    def generate_response_suggestions_stream(self, question: str, client_name: str = None, conversation_context: str = "", num_suggestions: int = 2, query_embedding: Optional[List[float]] = None) -> Tuple[Iterator[str], List[Dict]]:
+        """
+        Streaming variant of generate_response_suggestions.
+        
+        Args:
+            question: Client's inquiry/question
+            client_name: Name of the client (for personalization)
+            conversation_context: Previous conversation context
+            num_suggestions: Number of response suggestions to generate (default: 2)
+            query_embedding: Precomputed embedding of the question (skips re-embedding)
             
-            return {
-                "suggestions": suggestions,
-                "source_documents": filtered_sources,
-                "client_name": client_name,
-                "inquiry": question
-            }
+        Returns:
+            Tuple of (iterator over LLM text chunks, source documents). Pass the
+            accumulated text to finalize_response_suggestions once streaming ends.
+        """
+        if not self.ready:
+            raise ValueError("Vector store not initialized. Please process documents first.")
+        
+        try:
+            logger.info(f"[RAG] Streaming {num_suggestions} suggestions for: {question[:80]}")
+            full_prompt, filtered_sources = self._build_suggestions_prompt(question, client_name, conversation_context, num_suggestions, query_embedding)
         except Exception as e:
             raise Exception(f"Error generating response suggestions: {str(e)}")
+        
+        def token_stream():
+            for chunk in self.llm.stream(full_prompt):
+                # Chat models yield message chunks, plain LLMs yield strings
+                yield getattr(chunk, "content", chunk)
+        
+        return token_stream(), filtered_sources
+    
+    def finalize_response_suggestions(self, answer_text, source_documents: List[Dict], question: str, client_name: str = None, num_suggestions: int = 2) -> Dict[str, any]:
+        """
+        Validate and parse raw LLM output into response suggestions.
+        
+        Args:
+            answer_text: Full LLM output (string or message)
+            source_documents: Filtered source documents for the inquiry
+            question: Client's inquiry/question
+            client_name: Name of the client
+            num_suggestions: Number of response suggestions expected
+            
+        Returns:
+            Dictionary with multiple answer suggestions and source documents
+        """
+        answer_text = getattr(answer_text, "content", answer_text)
+        
+        # Validate response
+        if not answer_text or len(str(answer_text).strip()) < 10:
+            raise Exception("LLM returned empty or very short response")
+        
+        # Parse multiple responses
+        try:
+            suggestions = self._parse_response_suggestions(answer_text, num_suggestions)
+            
+            # If parsing failed, try to extract at least one response
+            if not suggestions or len(suggestions) == 0:
+                # Try to extract any response from the raw text
+                answer_str = str(answer_text).strip()
+                if len(answer_str) > 20:
+                    # Use the full answer as a single suggestion
+                    suggestions = [answer_str]
+                else:
+                    raise Exception("Could not parse any valid responses from LLM output")
+        except Exception as e:
+            raise Exception(f"Error parsing response suggestions: {str(e)}")
+        
+        return {
+            "suggestions": suggestions,
+            "source_documents": source_documents,
+            "client_name": client_name,
+            "inquiry": question
+        }
+    
+    def _build_suggestion_template(self, num_suggestions: int) -> str:
+        """
+        Suggestions template for a number of options, with the per-request fields left as placeholders.
+        
+        Filled in with format_map, so braces in the client name or conversation are never parsed as fields.
+        """
+        return self.prompt_templates.suggestion_prompt_template(
+            num_suggestions, "{client_name}", "{conv_context_text}", "{client_greeting}"
+        )
+    
+    def _build_suggestions_prompt(self, question: str, client_name: str, conversation_context: str, num_suggestions: int, query_embedding: Optional[List[float]] = None) -> Tuple[str, List[Dict]]:
+        """Retrieve context for a suggestions request and build the full LLM prompt."""
+        # Retrieve source documents first
+        source_docs = self._retrieve(question, query_embedding)
+        
+        # Format context
+        formatted_context = self._format_docs(source_docs)
+        
+        # Format conversation context
+        conv_context_text = f"Previous conversation:\n{conversation_context}\n" if conversation_context else ""
+        
+        # Build personalized prompt for multiple response suggestions
+        client_greeting = f"Dear {client_name}," if client_name else "Hello,"
+        
+        # Build the full prompt
+        full_prompt = self._suggestion_template(num_suggestions).format_map({
+            "client_name": client_name if client_name else "Not provided",
+            "conv_context_text": conv_context_text,
+            "client_greeting": client_greeting,
+            "context": formatted_context,
+            "question": question,
+        })
+        self._prompt_lengths.record(full_prompt)
+        
+        return full_prompt, self._filter_sources(source_docs)
+    
+    def _filter_sources(self, source_docs: List[Document]) -> List[Dict]:
+        """
+        Strip technical metadata from retrieved documents for display.
+        
+        Display name and preview are computed here once so the UI can render
+        them as-is on every rerun.
+        """
+        filtered_sources = []
+        for doc in source_docs:
+            # Extract clean source name (remove file paths, technical details)
+            source_name = _clean_source(doc.metadata.get("source", "Document"))
+            
+            # Get clean content (limit length, remove code-like patterns)
+            page_content = doc.page_content
+            content = page_content[:400] + "..." if len(page_content) > 400 else page_content
+            
+            # Only include relevant metadata (page number if available)
+            clean_metadata = {}
+            if "total_pages" in doc.metadata:
+                clean_metadata["pages"] = doc.metadata.get("total_pages", "")
+            
+            filtered_sources.append({
+                "content": content,
+                "source": source_name,
+                "metadata": clean_metadata,
+                "display_name": source_name.translate(SOURCE_NAME_TABLE).title(),
+                "preview": content[:200] + "..." if len(content) > 200 else content
+            })
+        
+        return filtered_sources
     
     def _parse_response_suggestions(self, text: str, num_suggestions: int) -> list:
-        """Parse multiple response suggestions from LLM output."""
-        import re
+        """
+        Parse multiple response suggestions from LLM output.
+        
+        One pass over the lines builds two splits side by side: one on
+        "Response N" labels, and one on bare "N." / "N:" lines, which only count
+        when N is the next expected index (1, 2, ... up to num_suggestions) so
+        numbered steps, dates or times inside a reply don't start a new one.
+        The labelled split wins if the output has any label. Only the marker is
+        removed from a marker line; every other line is kept unchanged.
+        Blank-line separated paragraphs are collected in the same pass as a
+        fallback for unnumbered output.
+        """
+        labelled = []  # Lines of each "Response N" suggestion
+        numbered = []  # Lines of each bare-numbered suggestion
+        paragraphs = []
+        paragraph = []
+        
+        def flush_paragraph():
+            part = "\n".join(paragraph).strip()
+            if len(part) > 20 and part not in paragraphs:
+                paragraphs.append(part)
+            paragraph.clear()
+        
+        for line in text.splitlines():
+            label = RESPONSE_LABEL_RE.match(line)
+            if label:
+                labelled.append([line[label.end():]])
+            elif labelled:
+                labelled[-1].append(line)
+            
+            number = NUMBERED_MARKER_RE.match(line)
+            if number and int(number.group(1)) == len(numbered) + 1 <= num_suggestions:
+                numbered.append([line[number.end():]])
+            elif numbered:
+                numbered[-1].append(line)
+            
+            marker = label or number
+            if marker:
+                flush_paragraph()
+                paragraph.append(line[marker.end():])
+            elif line.strip():
+                paragraph.append(line)
+            else:
+                flush_paragraph()
+        flush_paragraph()
         
         suggestions = []
+        for lines in labelled or numbered:
+            content = "\n".join(lines).strip()
+            if len(content) > 20:  # Valid response
+                suggestions.append(content)
+        
+        # If parsing failed, fall back to the paragraphs
+        for part in paragraphs:
+            if len(suggestions) >= num_suggestions:
+                break
+            if part not in suggestions:
+                suggestions.append(part)
         
-        # Try to find numbered responses
-        pattern = r"(?:Response\s+)?(\d+)[:.\-\s]+(.*?)(?=(?:Response\s+)?\d+[:.\-\s]+|$)"
-        matches = re.findall(pattern, text, re.DOTALL | re.IGNORECASE)
-        
-        if matches:
-            for num, content in matches:
-                content = content.strip()
-                if content and len(content) > 20:  # Valid response
-                    suggestions.append(content)
-        
-        # If parsing failed, split by common patterns
-        if len(suggestions) < num_suggestions:
-            # Try splitting by numbered lists or paragraphs
-            parts = re.split(r'\n\s*\n|\n(?=\d+[\.\)])', text)
-            for part in parts:
-                part = part.strip()
-                # Remove "Response X:" prefix if present
-                part = re.sub(r'^(?:Response\s+)?\d+[:.\-\s]+', '', part, flags=re.IGNORECASE).strip()
-                if part and len(part) > 20 and part not in suggestions:
-                    suggestions.append(part)
-                    if len(suggestions) >= num_suggestions:
-                        break
-        
-        # If still not enough, split the text into chunks
-        if len(suggestions) < num_suggestions:
-            # Use the full text as one suggestion, or split it
-            if len(suggestions) == 0:
-                # Split text into roughly equal parts
-                words = text.split()
-                chunk_size = len(words) // num_suggestions
-                for i in range(num_suggestions):
-                    start = i * chunk_size
-                    end = start + chunk_size if i < num_suggestions - 1 else len(words)
-                    chunk = " ".join(words[start:end])
-                    if chunk.strip():
-                        suggestions.append(chunk.strip())
+        # If still nothing, keep the whole answer as one suggestion rather than cutting it apart
+        if not suggestions and text.strip():
+            suggestions.append(text.strip())
         
         # Ensure we have at least the requested number
         while len(suggestions) < num_suggestions:
@@ -347,23 +547,24 @@ class RAGSystem:
         # Return only the requested number
         return suggestions[:num_suggestions]
     
-    def query(self, question: str, conversation_context: str = "") -> Dict[str, any]:
+    def query(self, question: str, conversation_context: str = "", query_embedding: Optional[List[float]] = None) -> Dict[str, any]:
         """
         Query the RAG system with a question.
         
         Args:
             question: User's question
             conversation_context: Previous conversation context for continuity
+            query_embedding: Precomputed embedding of the question (skips re-embedding)
             
         Returns:
             Dictionary with answer and source documents
         """
-        if not self.qa_chain:
+        if not self.ready:
             raise ValueError("Vector store not initialized. Please process documents first.")
         
         try:
             # Retrieve source documents first
-            source_docs = self._retriever.invoke(question)
+            source_docs = self._retrieve(question, query_embedding)
             
             # Format context
             formatted_context = self._format_docs(source_docs)
@@ -375,51 +576,23 @@ class RAGSystem:
             else:
                 enhanced_question = question
             
-            # Create prompt with context awareness
-            context_prompt_template = self.prompt_templates.context_prompt_template()
-            
             # Format conversation context for prompt
             conv_context_text = f"Previous conversation:\n{conversation_context}\n" if conversation_context else ""
             
             # Build the full prompt
-            full_prompt = context_prompt_template.format(
-                context=formatted_context,
-                conversation_context=conv_context_text,
-                question=enhanced_question if conversation_context else question
-            )
+            full_prompt = self._ctx_tmpl_str.format_map({
+                "context": formatted_context,
+                "conversation_context": conv_context_text,
+                "question": enhanced_question if conversation_context else question,
+            })
+            self._prompt_lengths.record(full_prompt)
             
             # Get answer from LLM
             answer = self.llm.invoke(full_prompt)
             
-            # Filter source documents - remove technical metadata, keep business-relevant info
-            filtered_sources = []
-            for doc in source_docs:
-                # Extract clean source name (remove file paths, technical details)
-                source_name = doc.metadata.get("source", "Document")
-                # Clean up source name - remove technical paths
-                if "/" in source_name or "\\" in source_name:
-                    source_name = source_name.split("/")[-1].split("\\")[-1]
-                # Remove file extensions for cleaner display
-                if "." in source_name:
-                    source_name = source_name.rsplit(".", 1)[0]
-                
-                # Get clean content (limit length, remove code-like patterns)
-                content = doc.page_content[:400] + "..." if len(doc.page_content) > 400 else doc.page_content
-                
-                # Only include relevant metadata (page number if available)
-                clean_metadata = {}
-                if "total_pages" in doc.metadata:
-                    clean_metadata["pages"] = doc.metadata.get("total_pages", "")
-                
-                filtered_sources.append({
-                    "content": content,
-                    "source": source_name,
-                    "metadata": clean_metadata
-                })
-            
             return {
                 "answer": answer.content,
-                "source_documents": filtered_sources
+                "source_documents": self._filter_sources(source_docs)
             }
         except Exception as e:
             raise Exception(f"Error querying RAG system: {str(e)}")
@@ -431,10 +604,14 @@ class RAGSystem:
         self.vectorstore = self.vectorstore_manager.vectorstore
         self.retriever = self.vectorstore_manager.retriever
         if loaded and self.vectorstore and self.retriever:
-            self._create_qa_chain()
+            self._prepare_query_path()
             return True
         return False
         
+    def has_document(self, file_hash: str) -> bool:
+        """Check whether a file with the given content hash is already in the vector store."""
+        return self.vectorstore_manager.has_file_hash(file_hash)
+        
     def get_vectorstore_info(self) -> Dict[str, any]:
         """Get information about the current vector store."""
         return self.vectorstore_manager.get_vectorstore_info()
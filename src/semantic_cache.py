@@ -0,0 +1,184 @@
+"""
+Semantic answer cache keyed on query embeddings.
+
+Near-duplicate questions (high cosine similarity) reuse an earlier answer.
+Candidates are found with random-projection LSH and confirmed with the exact
+cosine similarity, so a lookup never scans the whole cache.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+import src.config as config
+
+
+class SemanticCache:
+    """
+    LSH-indexed cache of answers by query embedding, with TTL and LRU eviction.
+
+    Used as the embedding index of QuestionCache, so its size and TTL default
+    to the question cache settings.
+
+    Each of the num_tables hash tables keys a vector by the signs of num_bits
+    random projections, so vectors at a small angle share a bucket in at least
+    one table with high probability. The owning cache is shared by every
+    session, so all access is guarded by a lock.
+    """
+
+    def __init__(
+        self,
+        threshold: float = None,
+        max_entries: int = None,
+        ttl: float = None,
+        num_tables: int = 8,
+        num_bits: int = 8,
+        seed: int = 0,
+    ):
+        """
+        Initialize an empty cache.
+
+        Args:
+            threshold: Minimum cosine similarity for a hit (default from config)
+            max_entries: Entries kept before the least recently used is evicted (default from config)
+            ttl: Seconds an entry stays valid (default from config)
+            num_tables: Number of LSH hash tables
+            num_bits: Projections (key bits) per table
+            seed: Seed for the random projections
+        """
+        self.threshold = threshold if threshold is not None else config.SEMANTIC_CACHE_THRESHOLD
+        self.max_entries = max_entries if max_entries is not None else config.QUESTION_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else config.QUESTION_CACHE_TTL
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+        # Projections are drawn once the embedding dimension is known
+        self._projections: Optional[np.ndarray] = None
+        self._bit_weights = 1 << np.arange(num_bits, dtype=np.int64)
+
+        # entry id -> (unit vector, payload, created_at, bucket keys), least recently used first
+        self._entries: "OrderedDict[int, Tuple[np.ndarray, Any, float, Tuple[int, ...]]]" = OrderedDict()
+        self._tables: List[Dict[int, Set[int]]] = [{} for _ in range(num_tables)]
+        # Caller-supplied key -> entry id, so an entry can be replaced or dropped by key
+        self._by_key: Dict[Hashable, int] = {}
+        self._ids_to_key: Dict[int, Hashable] = {}
+        self._next_id = 0
+
+    def _unit(self, embedding: Sequence[float]) -> Optional[np.ndarray]:
+        """Embedding as a normalized float32 vector, or None if it has no direction."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return None
+        return vector / norm
+
+    def _keys(self, vector: np.ndarray) -> Tuple[int, ...]:
+        """Bucket key of the vector in every table (caller holds the lock)."""
+        if self._projections is None or self._projections.shape[0] != vector.shape[0]:
+            # First vector, or the embedding model changed: start over with new projections
+            self._projections = self._rng.standard_normal(
+                (vector.shape[0], self.num_tables * self.num_bits)
+            ).astype(np.float32)
+            self._entries.clear()
+            self._tables = [{} for _ in range(self.num_tables)]
+            self._by_key.clear()
+            self._ids_to_key.clear()
+        bits = (vector @ self._projections > 0).reshape(self.num_tables, self.num_bits)
+        return tuple(int(key) for key in bits @ self._bit_weights)
+
+    def _remove(self, entry_id: int):
+        """Drop an entry and its bucket references (caller holds the lock)."""
+        _, _, _, keys = self._entries.pop(entry_id)
+        key = self._ids_to_key.pop(entry_id, None)
+        if key is not None:
+            del self._by_key[key]
+        for table, key in zip(self._tables, keys):
+            bucket = table.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[key]
+
+    def get(self, embedding: Sequence[float]) -> Optional[Any]:
+        """
+        Find the payload cached for the most similar earlier query.
+
+        Args:
+            embedding: Query embedding
+
+        Returns:
+            Cached payload, or None if no live entry reaches the threshold
+        """
+        vector = self._unit(embedding)
+        if vector is None:
+            return None
+
+        with self._lock:
+            keys = self._keys(vector)
+            candidates = set()
+            for table, key in zip(self._tables, keys):
+                candidates.update(table.get(key, ()))
+
+            now = time.time()
+            best_id, best_score = None, self.threshold
+            for entry_id in candidates:
+                cached_vector, _, created_at, _ = self._entries[entry_id]
+                if now - created_at > self.ttl:
+                    self._remove(entry_id)
+                    continue
+                score = float(vector @ cached_vector)
+                if score >= best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][1]
+
+    def put(self, embedding: Sequence[float], payload: Any, key: Hashable = None):
+        """
+        Cache a payload for a query embedding.
+
+        Args:
+            embedding: Query embedding
+            payload: Value returned by get() for similar queries
+            key: Optional key; an earlier entry with the same key is replaced
+        """
+        vector = self._unit(embedding)
+        if vector is None:
+            return
+
+        with self._lock:
+            keys = self._keys(vector)
+            if key is not None and key in self._by_key:
+                self._remove(self._by_key[key])
+            entry_id = self._next_id
+            self._next_id += 1
+            if key is not None:
+                self._by_key[key] = entry_id
+                self._ids_to_key[entry_id] = key
+            self._entries[entry_id] = (vector, payload, time.time(), keys)
+            for table, key in zip(self._tables, keys):
+                table.setdefault(key, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, key: Hashable):
+        """Drop the entry stored under a key, if any."""
+        with self._lock:
+            entry_id = self._by_key.get(key)
+            if entry_id is not None:
+                self._remove(entry_id)
+
+    def clear(self):
+        """Drop every entry, e.g. after the document set changed."""
+        with self._lock:
+            self._entries.clear()
+            self._tables = [{} for _ in range(self.num_tables)]
+            self._by_key.clear()
+            self._ids_to_key.clear()
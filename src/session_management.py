@@ -1,17 +1,68 @@
 import streamlit as st
-from src.conversation_management import ConversationManager
+from src.conversation_management import ConversationManager, QuestionCache
 from src.sqlite_manager import SQLiteManager
+from src.rag_system import RAGSystem
 import time
 from src.config import SESSION_TIMEOUT
 from src.utils.logger import AppLogger
 from typing import Dict, Any
 
 logger = AppLogger(name="session_management")
+
+@st.cache_resource
+def get_question_cache() -> QuestionCache:
+    """
+    Answer cache shared by every session, so its index is built once per process.
+    
+    Only answers generated without thread history are stored (see
+    ConversationManager.cache_answer), so nothing from one user's thread is
+    served to another.
+    """
+    return QuestionCache(SQLiteManager())
+
+@st.cache_resource(show_spinner="Initializing RAG system...")
+def get_rag_system() -> RAGSystem:
+    """Build the RAG system once per process; every page and session shares the same instance."""
+    rag = RAGSystem(answer_cache=get_question_cache())
+    # Try to load existing vector store
+    rag.load_vectorstore()
+    return rag
+
 class SessionManager:
     """Handles Streamlit session state initialization and management."""
     
     # --- INITIALIZATION ---
     
+    # Session variables with immutable defaults
+    _DEFAULTS = (
+        ("session_token", None),
+        ("user_id", None),
+        ("current_user", None),
+        ("rag_system", None),
+        ("messages_version", 0),
+        ("documents_processed", False),
+        ("current_thread_id", None),
+        ("use_cache", True),
+        ("pasted_image", False),
+        ("regenerate_response", False),
+        ("is_processing", False),
+        ("pending_query", None),
+        ("is_suggestion_generated", False),
+        ("selected_response_idx", None),
+        ("selected_response", None),
+        ("current_tab", "tab1"),
+        ("authenticated", False),
+    )
+    
+    # Session variables whose default is created from the session state
+    _FACTORIES = (
+        ("messages", lambda state: []),
+        ("pending_inquiry", lambda state: {}),
+        ("current_suggestions", lambda state: {}),
+        ("db", lambda state: SQLiteManager()),
+        ("conversation_manager", lambda state: ConversationManager(db=state.db, question_cache=get_question_cache())),
+    )
+    
     def __init__(self, cookies: Any):
         self.cookies = cookies
         self._initialize_sessions()
@@ -21,79 +72,18 @@ class SessionManager:
         if st.session_state.get("_initialized", False):
             return
         
-        if "session_token" not in st.session_state:
-            st.session_state.session_token = None
+        state = st.session_state
+        for key, value in self._DEFAULTS:
+            if key not in state:
+                state[key] = value
         
-        if "user_id" not in st.session_state:
-            st.session_state.user_id = None
-            
-        if "current_user" not in st.session_state:
-            st.session_state.current_user = None
+        # Mutable or expensive defaults are built per session, in order (conversation_manager needs db)
+        for key, factory in self._FACTORIES:
+            if key not in state:
+                state[key] = factory(state)
         
-        if "rag_system" not in st.session_state:
-            st.session_state.rag_system = None
-            
-        if "messages" not in st.session_state:
-            st.session_state['messages'] = []
-
-        if "documents_processed" not in st.session_state:
-            st.session_state.documents_processed = False
-            
-        if "db" not in st.session_state:
-            st.session_state.db = SQLiteManager()
-
-        if "conversation_manager" not in st.session_state:
-            st.session_state.conversation_manager = ConversationManager(db=st.session_state.db)
-
-        if "current_thread_id" not in st.session_state:
-            st.session_state.current_thread_id = None
-
-        if "use_cache" not in st.session_state:
-            st.session_state.use_cache = True
-
-        if "image_processor" not in st.session_state:
-            try:
-                from src.image_processor import ImageProcessor
-                st.session_state.image_processor = ImageProcessor()
-            except Exception as e:
-                st.warning(f"⚠️ ImageProcessor init failed: {e}")
-                st.session_state.image_processor = None
-
-        if "pasted_image" not in st.session_state:
-            st.session_state.pasted_image = False
-
-        if "regenerate_response" not in st.session_state:
-            st.session_state.regenerate_response = False
-
-        if "is_processing" not in st.session_state:
-            st.session_state.is_processing = False
-            
-        if "pending_query" not in st.session_state:
-            st.session_state.pending_query = None
-            
-        if "pending_inquiry" not in st.session_state:
-            st.session_state.pending_inquiry = {}
-            
-        if "current_suggestions" not in st.session_state:
-            st.session_state.current_suggestions = {}
-            
-        if "is_suggestion_generated" not in st.session_state:
-            st.session_state.is_suggestion_generate = False
-            
-        if "selected_response_idx" not in st.session_state:
-            st.session_state.selected_response_idx = None
-            
-        if "selected_response" not in st.session_state:
-            st.session_state.selected_response = None
-        
-        if "current_tab" not in st.session_state:
-            st.session_state.current_tab = "tab1"
-        
-        if "authenticated" not in st.session_state:
-            st.session_state.authenticated = False
-            
-        if "cookies" not in st.session_state:
-            st.session_state.cookies = self.cookies
+        if "cookies" not in state:
+            state.cookies = self.cookies
         
         st.session_state["_initialized"] = True
     # --- GETTER & SETTER ---
@@ -108,6 +98,16 @@ class SessionManager:
     
     # --- METHODS ---
     
+    def append_message(self, role: str, content: str):
+        """Append a message to the chat history and bump the history version."""
+        st.session_state.messages.append({"role": role, "content": content})
+        st.session_state.messages_version = st.session_state.get("messages_version", 0) + 1
+        
+    def set_messages(self, messages: list):
+        """Replace the chat history (e.g. when switching threads) and bump the history version."""
+        st.session_state.messages = messages
+        st.session_state.messages_version = st.session_state.get("messages_version", 0) + 1
+    
     def get_session_snapshot(self):
         return st.session_state
     
@@ -117,7 +117,7 @@ class SessionManager:
         
     def reset_conversation(self):
         """Clear conversation-related states."""
-        st.session_state.messages = []
+        self.set_messages([])
         st.session_state.current_thread_id = None
         st.session_state.regenerate_response = False
         
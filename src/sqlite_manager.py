@@ -1,3 +1,4 @@
+import json
 import sqlite3
 from datetime import datetime
 import time
@@ -25,7 +26,10 @@ class SQLiteManager:
     # --- Core Connection Utilities ---
     def _connect(self):
         """Create and return a SQLite connection."""
-        return sqlite3.connect(self.db_path, check_same_thread=False)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        # With WAL, NORMAL only syncs at checkpoints instead of on every commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
     
     def execute(
         self,
@@ -103,6 +107,9 @@ class SQLiteManager:
     def _init_default_schema(self):
         """Initialize default tables for chat history"""
         with self._connect() as conn:
+            # Write-ahead log: commits append to the -wal file and are checkpointed
+            # into the database in the background (the mode persists in the file)
+            conn.execute("PRAGMA journal_mode=WAL")
             conn.executescript("""
                                 CREATE TABLE IF NOT EXISTS users (
                                     id TEXT PRIMARY KEY,
@@ -130,13 +137,25 @@ class SQLiteManager:
                                     FOREIGN KEY(conversation_id) REFERENCES conversations (id)
                                 );
                                 
+                                CREATE INDEX IF NOT EXISTS idx_messages_conversation
+                                    ON messages (conversation_id, position);
+                                
                                 CREATE TABLE IF NOT EXISTS sessions (
                                     user_id TEXT NOT NULL,
                                     session_token TEXT PRIMARY KEY,
                                     created_at INTEGER NOT NULL,
                                     expires_at INTEGER NOT NULL,
                                     FOREIGN KEY(user_id) REFERENCES users (id)
-                                )
+                                );
+                                
+                                CREATE TABLE IF NOT EXISTS question_cache (
+                                    hash TEXT PRIMARY KEY,
+                                    question TEXT NOT NULL,
+                                    answer TEXT NOT NULL,
+                                    source_documents TEXT,
+                                    tokens TEXT,
+                                    created_at REAL
+                                );
                                 """)
             conn.commit()
             
@@ -209,6 +228,41 @@ class SQLiteManager:
         
         return new_position
     
+    def add_messages(
+        self,
+        conversation_id: str,
+        messages: List[Tuple[str, str]]
+    ) -> int:
+        """
+        Store several chat messages in one transaction with sequential positions.
+        
+        Args:
+            conversation_id: Conversation the messages belong to
+            messages: (sender, message) pairs in order
+            
+        Returns:
+            Position of the last stored message
+        """
+        with self._connect() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT COALESCE(MAX(position), 0) FROM messages WHERE conversation_id = ?",
+                (conversation_id,)
+            )
+            last_position = cursor.fetchone()[0] or 0
+            
+            rows = [
+                (f"MSG_{uuid.uuid4().hex[:12]}", conversation_id, last_position + offset, sender, message)
+                for offset, (sender, message) in enumerate(messages, start=1)
+            ]
+            cursor.executemany(
+                "INSERT INTO messages (id, conversation_id, position, sender, message) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            
+        return last_position + len(rows)
+    
     def get_all_messages_from_conversation(self, conversation_id: str) -> List[Dict]:
         """Retrieve all messages for a conversation ordered by position."""
         return self.select(
@@ -239,6 +293,25 @@ class SQLiteManager:
             fetch="all"
         )
         
+    def get_conversation_summaries_of_user(self, user_id: str) -> List[Dict]:
+        """
+        Get a user's conversations with their message counts, newest first.
+        Each row includes: id, title, created_at, message_count.
+        """
+        return self.execute(
+            """
+            SELECT c.id, c.title, c.created_at, COUNT(m.id) AS message_count
+            FROM conversations c
+            LEFT JOIN messages m ON m.conversation_id = c.id
+            WHERE c.user_id = ?
+            GROUP BY c.id
+            ORDER BY c.created_at DESC
+            """,
+            (user_id,),
+            fetch="all",
+            as_dict=True
+        )
+        
     def get_conversation_of_user(self, conversation_id: str, user_id: str) -> Dict:
         """
         Get the conversation of the conversation_id from SQLite.
@@ -392,6 +465,77 @@ class SQLiteManager:
             params = (token,)
         )
         
+# ==================== QUESTION CACHE ====================
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        """Compact JSON for TEXT columns."""
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+    
+    def get_cached_answers(self, min_created_at: float = 0.0, limit: int = -1) -> List[Dict]:
+        """
+        Get cached answers, oldest first, with their JSON columns decoded.
+        Each row includes: hash, question, answer, source_documents, tokens, created_at.
+        
+        Args:
+            min_created_at: Skip answers cached before this epoch time
+            limit: Return only the newest rows (-1 = all)
+        """
+        rows = self.execute(
+            """
+            SELECT * FROM (
+                SELECT hash, question, answer, source_documents, tokens, created_at
+                FROM question_cache
+                WHERE created_at >= ?
+                ORDER BY created_at DESC
+                LIMIT ?
+            ) ORDER BY created_at
+            """,
+            (min_created_at, limit),
+            "all",
+            as_dict=True
+        )
+        for row in rows:
+            row["answer"] = json.loads(row["answer"])
+            row["source_documents"] = json.loads(row["source_documents"] or "[]")
+            row["tokens"] = json.loads(row["tokens"] or "[]")
+        return rows
+    
+    def put_cached_answers(self, entries: List[Tuple[str, str, Any, List[Dict], List[str], float]]) -> None:
+        """
+        Insert or replace cached answers in one transaction.
+        
+        Args:
+            entries: (hash, question, answer, source_documents, tokens, created_at) tuples
+        """
+        rows = [
+            (question_hash, question, self._dumps(answer), self._dumps(source_documents), self._dumps(tokens), created_at)
+            for question_hash, question, answer, source_documents, tokens, created_at in entries
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO question_cache (hash, question, answer, source_documents, tokens, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+    
+    def prune_cached_answers(self, min_created_at: float, keep: int) -> None:
+        """Delete cached answers older than min_created_at or beyond the newest keep rows."""
+        self.delete_row(
+            "question_cache",
+            "created_at IS NULL OR created_at < ? OR hash NOT IN (SELECT hash FROM question_cache ORDER BY created_at DESC LIMIT ?)",
+            (min_created_at, keep)
+        )
+    
+    def delete_cached_answers(self, hashes: List[str]) -> None:
+        """Delete cached answers by question hash in one transaction."""
+        with self._connect() as conn:
+            conn.executemany("DELETE FROM question_cache WHERE hash = ?", [(question_hash,) for question_hash in hashes])
+            conn.commit()
+    
+    def clear_cached_answers(self) -> None:
+        """Delete every cached answer, e.g. after the documents changed."""
+        self.delete_all_rows("question_cache")
+        
         
 # --------------- TEST ----------------
 
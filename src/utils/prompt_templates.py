@@ -31,13 +31,13 @@ class PromptTemplates:
     def suggestion_prompt_template(num_suggestions: int, client_name: str, conv_context_text: str, client_greeting: str) -> str:
         suggestions_prompt_template = f"""You are a customer service representative helping clients with inquiries. Generate {num_suggestions} different response options that are friendly, accommodating, heartfelt, empathizing, professional, and personalized.
 
+                                    Information from company documents:
+                                    {{context}}
+
                                     Client Information:
                                     - Client Name: {client_name if client_name else 'Not provided'}
                                     - Inquiry: {{question}}
 
-                                    Information from company documents:
-                                    {{context}}
-
                                     {conv_context_text}
 
                                     Response Guidelines:
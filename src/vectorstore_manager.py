@@ -1,4 +1,5 @@
-from typing import Dict, List
+import itertools
+from typing import Dict, Iterable
 from langchain_core.documents import Document
 import src.config as config
 import os
@@ -15,40 +16,45 @@ class VectorstoreManager:
         self.vectorstore = None
         self.retriever = None
         
-    def create_vectorstore(self, documents: List[Document], persist: bool = True):
-        """Create or update vectorstore from documents with batch processing for GPU optimization"""
-        if not documents:
+    def create_vectorstore(self, documents: Iterable[Document], persist: bool = True):
+        """
+        Create or update vectorstore from documents with batch processing for GPU optimization.
+        
+        Documents may be a lazy iterable; each batch is embedded as soon as it is
+        filled, so upstream parsing and embedding overlap.
+        """
+        documents = iter(documents)
+        first = next(documents, None)
+        if first is None:
             raise ValueError("No documents provided")
+        documents = itertools.chain([first], documents)
         
         try:
             batch_size = getattr(config, 'EMBEDDING_BATCH_SIZE', 200)
             
-            if persist and os.path.exists(config.PERSIST_DIRECTORY):
-                self.vectorstore = Chroma(
-                    persist_directory=config.PERSIST_DIRECTORY,
-                    embedding_function=self.embeddings,
-                )
-                if len(documents) > batch_size:
-                    for i in range(0, len(documents), batch_size):
-                        batch = documents[i:i + batch_size]
-                        self.vectorstore.add_documents(batch)
-                        print(f"Processed batch {i//batch_size + 1}/{(len(documents) + batch_size - 1)//batch_size} ({len(batch)} chunks)")
-                else:
-                    self.vectorstore.add_documents(documents)
-            else:
-                # Create new vector store with batch processing
-                self.vectorstore = Chroma.from_documents(
-                    documents=documents,
-                    embedding=self.embeddings,
-                    persist_directory=config.PERSIST_DIRECTORY if persist else None
-                )
+            # Opens the existing persisted store, or creates it (in memory when not persisting)
+            self.vectorstore = Chroma(
+                persist_directory=config.PERSIST_DIRECTORY if persist else None,
+                embedding_function=self.embeddings,
+            )
+            
+            total = 0
+            batch_num = 0
+            while True:
+                batch = list(itertools.islice(documents, batch_size))
+                if not batch:
+                    break
+                self.vectorstore.add_documents(batch)
+                total += len(batch)
+                batch_num += 1
+                print(f"Processed batch {batch_num} ({len(batch)} chunks, {total} total)")
             
             # Create retriever
             self.retriever = self.vectorstore.as_retriever(
                 search_kwargs={"k": config.TOP_K}
             )
             
-            print(f"Vector store created with {len(documents)} document chunks (GPU optimized)")
+            print(f"Vector store created with {total} document chunks (GPU optimized)")
             
         except Exception as e:
             raise Exception(f"Failed to create vector store: {str(e)}")
@@ -74,6 +80,18 @@ class VectorstoreManager:
             print(f"Error loading vector store: {str(e)}")
             return False
         
+    def has_file_hash(self, file_hash: str) -> bool:
+        """Check whether chunks tagged with the given file hash already exist"""
+        if not self.vectorstore or not file_hash:
+            return False
+        
+        try:
+            result = self.vectorstore.get(where={"file_hash": file_hash}, limit=1)
+            return bool(result and result.get("ids"))
+        except Exception as e:
+            print(f"Error checking file hash: {str(e)}")
+            return False
+        
     def get_vectorstore_info(self) -> Dict[str, any]:
         """Get information about the current vector store."""
         if not self.vectorstore: